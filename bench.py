@@ -0,0 +1,139 @@
+import os
+import struct
+import sys
+from calendar import timegm
+from timeit import timeit
+from time1 import TimeCodec
+from zk_commands import USHRT_MAX
+from zk_util import parse_time_to_date, create_checksum, update_checksum, decode_tcp_header, PacketCodec, decode_record_data_40, decode_records_40, decode_record_data_16, decode_records_16, decode_user_data_72, decode_users_72, decode_user_data_28, decode_users_28
+
+def create_checksum_reference(buf):
+    # The original per-word checksum, kept as the baseline.
+    chksum = 0
+    for i in range(0, len(buf), 2):
+        if i == len(buf) - 1:
+            chksum += buf[i]
+        else:
+            chksum += struct.unpack('<H', buf[i:i+2])[0]
+        chksum %= USHRT_MAX
+    chksum = USHRT_MAX - chksum - 1
+
+    return chksum
+
+def create_tcp_header_reference(command, session_id, reply_id, data=b''):
+    buf = bytearray(8 + len(data))
+    struct.pack_into('<H', buf, 0, command)
+    struct.pack_into('<H', buf, 2, 0)
+    struct.pack_into('<H', buf, 4, session_id)
+    struct.pack_into('<H', buf, 6, reply_id)
+    buf[8:] = data
+    struct.pack_into('<H', buf, 2, create_checksum_reference(buf))
+    struct.pack_into('<H', buf, 6, (reply_id + 1) % USHRT_MAX)
+    prefix_buf = bytearray([0x50, 0x50, 0x82, 0x7d, 0x13, 0x00, 0x00, 0x00])
+    struct.pack_into('<H', prefix_buf, 4, len(buf))
+    return prefix_buf + buf
+
+def decode_loop_reference(buf, size, decode):
+    # The original tail-slicing loop, quadratic on bytes.
+    records = []
+    while len(buf) >= size:
+        records.append(decode(buf[:size]))
+        buf = buf[size:]
+    return records
+
+def sample_record(size):
+    record = bytearray(size)
+    struct.pack_into('<H', record, 0, 42)
+    if size == 40:
+        record[2:7] = b'12345'
+        struct.pack_into('<L', record, 27, 800000000)
+    elif size == 16:
+        struct.pack_into('<L', record, 4, 800000000)
+    elif size == 72:
+        record[3:7] = b'1234'
+        record[11:19] = b'John Doe'
+        struct.pack_into('<I', record, 35, 5000)
+        record[48:53] = b'12345'
+    elif size == 28:
+        record[8:12] = b'John'
+        struct.pack_into('<L', record, 24, 12345)
+    return bytes(record)
+
+def report(name, size, baseline, fast):
+    print(f"{name:<28}{size:>10}{baseline * 1e6:>14.1f}{fast * 1e6:>14.1f}{baseline / fast:>10.1f}x")
+
+def bench_checksum():
+    print(f"{'checksum':<28}{'bytes':>10}{'reference us':>14}{'fast us':>14}{'speedup':>11}")
+    for size in [16, 1024, 16 * 1024 + 1, 64 * 1024]:
+        buf = bytearray(os.urandom(size))
+        assert create_checksum(buf) == create_checksum_reference(buf)
+        number = max(1, 200000 // size)
+        baseline = timeit(lambda: create_checksum_reference(buf), number=number) / number
+        fast = timeit(lambda: create_checksum(buf), number=number) / number
+        report('create_checksum', size, baseline, fast)
+
+    buf = bytearray(os.urandom(64 * 1024))
+    chksum = create_checksum(buf)
+    old_word = struct.unpack_from('<H', buf, 6)[0]
+    struct.pack_into('<H', buf, 6, (old_word + 1) % USHRT_MAX)
+    assert update_checksum(chksum, old_word, (old_word + 1) % USHRT_MAX) == create_checksum(buf)
+    rescan = timeit(lambda: create_checksum(buf), number=200) / 200
+    incremental = timeit(lambda: update_checksum(chksum, old_word, old_word + 1), number=200000) / 200000
+    report('update_checksum vs rescan', len(buf), rescan, incremental)
+
+def bench_codec():
+    print(f"{'codec':<28}{'bytes':>10}{'reference us':>14}{'codec us':>14}{'speedup':>11}")
+    codec = PacketCodec(True, 0x1234)
+    out = bytearray(16 + 1024)
+    for data in [b'', struct.pack('<II', 0, 65472), os.urandom(1024)]:
+        assert codec.encode(1504, 7, data) == create_tcp_header_reference(1504, 0x1234, 7, data)
+        baseline = timeit(lambda: create_tcp_header_reference(1504, 0x1234, 7, data), number=20000) / 20000
+        fast = timeit(lambda: codec.encode_into(out, 1504, 7, data), number=20000) / 20000
+        report('encode tcp packet', len(data), baseline, fast)
+
+    reply = bytes(codec.encode(2000, 7, b'\x00' * 8))
+    baseline = timeit(lambda: decode_tcp_header(reply[:16]), number=100000) / 100000
+    fast = timeit(lambda: codec.decode_header(reply), number=100000) / 100000
+    report('decode tcp header', len(reply), baseline, fast)
+
+def bench_decode():
+    print(f"{'decode':<28}{'records':>10}{'reference/s':>14}{'batch/s':>14}{'speedup':>11}")
+    layouts = [
+        ('attendance 40', 40, decode_record_data_40, decode_records_40),
+        ('attendance 16', 16, decode_record_data_16, decode_records_16),
+        ('users 72', 72, decode_user_data_72, decode_users_72),
+        ('users 28', 28, decode_user_data_28, decode_users_28),
+    ]
+    for name, size, decode, decode_batch in layouts:
+        for count in [10000, 100000, 1000000]:
+            buf = sample_record(size) * count
+            fast = timeit(lambda: decode_batch(buf), number=1)
+            if count <= 10000:
+                assert decode_loop_reference(buf, size, decode) == decode_batch(buf)
+                baseline = timeit(lambda: decode_loop_reference(buf, size, decode), number=1)
+                print(f"{name:<28}{count:>10}{count / baseline:>14.0f}{count / fast:>14.0f}{baseline / fast:>10.1f}x")
+            else:
+                # The quadratic reference takes minutes from here on.
+                print(f"{name:<28}{count:>10}{'-':>14}{count / fast:>14.0f}{'-':>11}")
+
+def bench_time():
+    print(f"{'time':<28}{'records':>10}{'reference/s':>14}{'codec/s':>14}{'speedup':>11}")
+    # A month of punches: many records share each day.
+    times = [800000000 + (i * 37) % (31 * 86400) for i in range(100000)]
+    codec = TimeCodec()
+    assert list(codec.to_epochs(times)) == [timegm(parse_time_to_date(t)) for t in times]
+    baseline = timeit(lambda: [timegm(parse_time_to_date(t)) for t in times], number=1)
+    fast = timeit(lambda: codec.to_epochs(times), number=1)
+    print(f"{'epoch via tuple':<28}{len(times):>10}{len(times) / baseline:>14.0f}{len(times) / fast:>14.0f}{baseline / fast:>10.1f}x")
+
+BENCHMARKS = {
+    'checksum': bench_checksum,
+    'codec': bench_codec,
+    'decode': bench_decode,
+    'time': bench_time,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
+        print()
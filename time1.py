@@ -1,40 +1,89 @@
+from array import array
+from calendar import timegm
 from datetime import datetime
+from time import gmtime
 
-def decode(time):
+# Packed ZK time: seconds into a calendar of 12 months of 31 days from 2000.
+DAY = 24 * 60 * 60
+
+def unpack(time):
     """
-    Decode a time integer into a datetime object.
-    
+    Split a time integer into its fields.
+
     :param time: The encoded time as an integer.
-    :return: A datetime object representing the decoded time.
+    :return: A (year, month, day, hour, minute, second) tuple.
     """
-    second = time % 60
-    time = (time - second) // 60
-
-    minute = time % 60
-    time = (time - minute) // 60
-
-    hour = time % 24
-    time = (time - hour) // 24
+    days, seconds = divmod(time, DAY)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    months, day = divmod(days, 31)
+    years, month = divmod(months, 12)
+    return (years + 2000, month + 1, day + 1, hour, minute, second)
 
-    day = time % 31 + 1
-    time = (time - (day - 1)) // 31
-
-    month = time % 12
-    time = (time - month) // 12
+def pack(year, month, day, hour=0, minute=0, second=0):
+    """
+    Encode date and time fields into a time integer; the inverse of unpack.
+    """
+    return ((year % 100) * 12 * 31 + (month - 1) * 31 + day - 1) * DAY + (hour * 60 + minute) * 60 + second
 
-    year = time + 2000
+def decode(time):
+    """
+    Decode a time integer into a datetime object.
 
-    return datetime(year, month + 1, day, hour, minute, second)
+    :param time: The encoded time as an integer.
+    :return: A datetime object representing the decoded time.
+    """
+    return datetime(*unpack(time))
 
 def encode(date):
     """
     Encode a datetime object into a time integer.
-    
+
     :param date: A datetime object representing the date and time.
     :return: The encoded time as an integer.
     """
-    return (
-        ((date.year % 100) * 12 * 31 + date.month * 31 + date.day - 1) * (24 * 60 * 60) +
-        (date.hour * 60 + date.minute) * 60 +
-        date.second
-    )
+    return pack(date.year, date.month, date.day, date.hour, date.minute, date.second)
+
+class TimeCodec:
+    """
+    Converts packed device times to and from epoch seconds.
+
+    The device clock has no zone, so `utc_offset` (seconds east of UTC) says
+    what it is set to; the default reads it as UTC. Only the day part of a
+    packed time needs calendar math, so each day's epoch base is computed
+    once and cached, and a conversion is then a divmod and an add.
+    """
+    def __init__(self, utc_offset=0):
+        self.utc_offset = utc_offset
+        self.days = {}
+
+    def day_base(self, days):
+        base = self.days.get(days)
+        if base is None:
+            year, month, day = unpack(days * DAY)[:3]
+            # timegm normalizes days the 31-day calendar allows but the month lacks.
+            base = timegm((year, month, day, 0, 0, 0)) - self.utc_offset
+            self.days[days] = base
+        return base
+
+    def to_epoch(self, time):
+        days, seconds = divmod(time, DAY)
+        return self.day_base(days) + seconds
+
+    def to_epochs(self, times):
+        # Batch form of to_epoch for a column of packed times, e.g. AttendanceColumns.record_time.
+        cache = self.days
+        day_base = self.day_base
+        epochs = array('q')
+        append = epochs.append
+        for time in times:
+            days, seconds = divmod(time, DAY)
+            base = cache.get(days)
+            if base is None:
+                base = day_base(days)
+            append(base + seconds)
+        return epochs
+
+    def from_epoch(self, epoch):
+        t = gmtime(int(epoch) + self.utc_offset)
+        return pack(t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
@@ -0,0 +1,156 @@
+import asyncio
+from handler import ZKError, ERROR_TYPES
+from zk_async_tcp import AsyncJTCP
+from zk_async_udp import AsyncJUDP
+
+class AsyncZKLIB:
+    def __init__(self, ip, port=4370, timeout=30, inport=0, pipeline_depth=4, udp_window=16):
+        self.connection_type = None
+        self.jtcp = AsyncJTCP(ip, port, timeout, pipeline_depth)
+        self.judp = AsyncJUDP(ip, port, timeout, inport, udp_window)
+        self.interval = None
+        self.timer = None
+        self.ip = ip
+
+    async def function_wrapper(self, tcp_callback, udp_callback=None, command=''):
+        if self.connection_type == 'tcp':
+            if self.jtcp.writer:
+                try:
+                    return await tcp_callback()
+                except Exception as err:
+                    raise ZKError(err, f"[TCP] {command}", self.ip)
+            else:
+                raise ZKError("Socket isn't connected!", "[TCP]", self.ip)
+        elif self.connection_type == 'udp':
+            if self.judp.transport:
+                try:
+                    return await udp_callback()
+                except Exception as err:
+                    raise ZKError(err, f"[UDP] {command}", self.ip)
+            else:
+                raise ZKError("Socket isn't connected!", "[UDP]", self.ip)
+        else:
+            raise ZKError("Socket isn't connected!", "", self.ip)
+
+    async def create_socket(self):
+        if not self.jtcp.writer:
+            if await self.jtcp.create_socket() and await self.jtcp.connect():
+                print('Connected via TCP')
+                self.connection_type = 'tcp'
+                return
+            await self.jtcp.close_socket()
+
+        try:
+            if not self.judp.transport:
+                print("Falling back to UDP...")
+                if not await self.judp.create_socket():
+                    raise ZKError(ERROR_TYPES.EADDRINUSE, 'UDP CONNECT', self.ip)
+            if not await self.judp.connect():
+                raise ZKError(ERROR_TYPES.ETIMEDOUT, 'UDP CONNECT', self.ip)
+            print('Connected via UDP')
+            self.connection_type = 'udp'
+        except ZKError:
+            self.connection_type = None
+            await self.judp.close_socket()
+            raise
+
+    async def get_users(self):
+        return await self.function_wrapper(self.jtcp.get_users, self.judp.get_users, 'get_users')
+
+    async def get_time(self):
+        return await self.function_wrapper(None, self.judp.get_time, 'get_time')
+
+    async def get_attendances(self, cb=None, result='records'):
+        return await self.function_wrapper(lambda: self.jtcp.get_attendances(cb, result), lambda: self.judp.get_attendances(cb, result), 'get_attendances')
+
+    async def set_user(self, uid, userid, name, password, role=0, cardno=0):
+        return await self.set_users([{'uid': uid, 'user_id': userid, 'name': name, 'password': password, 'role': role, 'cardno': cardno}])
+
+    async def set_users(self, users, refresh=True):
+        return await self.function_wrapper(lambda: self.jtcp.set_users(users, refresh), lambda: self.judp.set_users(users, refresh), 'set_users')
+
+    async def set_templates(self, templates, refresh=True):
+        return await self.function_wrapper(lambda: self.jtcp.set_templates(templates, refresh), lambda: self.judp.set_templates(templates, refresh), 'set_templates')
+
+    async def delete_users(self, uids, refresh=True):
+        return await self.function_wrapper(lambda: self.jtcp.delete_users(uids, refresh), lambda: self.judp.delete_users(uids, refresh), 'delete_users')
+
+    async def get_user_checksum(self):
+        return await self.function_wrapper(self.jtcp.get_user_checksum, self.judp.get_user_checksum, 'get_user_checksum')
+
+    async def iter_attendances(self):
+        records = await self.function_wrapper(lambda: self.iter_records('iter_attendances'), lambda: self.iter_records('iter_attendances'), 'iter_attendances')
+        try:
+            async for batch in records:
+                yield batch
+        except Exception as err:
+            raise ZKError(err, f"[{self.connection_type.upper()}] iter_attendances", self.ip)
+
+    async def iter_templates(self):
+        templates = await self.function_wrapper(lambda: self.iter_records('iter_templates'), lambda: self.iter_records('iter_templates'), 'iter_templates')
+        try:
+            async for batch in templates:
+                yield batch
+        except Exception as err:
+            raise ZKError(err, f"[{self.connection_type.upper()}] iter_templates", self.ip)
+
+    async def iter_records(self, name):
+        return getattr(self.jtcp if self.connection_type == 'tcp' else self.judp, name)()
+
+    async def get_real_time_logs(self, cb):
+        return await self.function_wrapper(None, lambda: self.judp.get_real_time_logs(cb), 'get_real_time_logs')
+
+    async def disconnect(self):
+        return await self.function_wrapper(self.jtcp.disconnect, self.judp.disconnect, 'disconnect')
+
+    async def free_data(self):
+        return await self.function_wrapper(self.jtcp.free_data, self.judp.free_data, 'free_data')
+
+    async def disable_device(self):
+        return await self.function_wrapper(self.jtcp.disable_device, self.judp.disable_device, 'disable_device')
+
+    async def enable_device(self):
+        return await self.function_wrapper(self.jtcp.enable_device, self.judp.enable_device, 'enable_device')
+
+    async def get_info(self):
+        return await self.function_wrapper(self.jtcp.get_info, self.judp.get_info, 'get_info')
+
+    async def clear_attendance_log(self):
+        return await self.function_wrapper(None, self.judp.clear_attendance_log, 'clear_attendance_log')
+
+    async def execute_cmd(self, command, data=''):
+        return await self.function_wrapper(lambda: self.jtcp.execute_cmd(command, data), lambda: self.judp.execute_cmd(command, data), 'execute_cmd')
+
+    async def set_interval_schedule(self, cb, timer):
+        self.interval = True
+        while self.interval:
+            result = cb()
+            if asyncio.iscoroutine(result):
+                await result
+            await asyncio.sleep(timer)
+
+    async def set_timer_schedule(self, cb, timer):
+        self.timer = asyncio.get_running_loop().time() + timer
+        await asyncio.sleep(timer)
+        result = cb()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+# Example usage: poll several devices concurrently from one event loop
+if __name__ == "__main__":
+    async def poll(ip):
+        zk_instance = AsyncZKLIB(ip, 4370, 10)
+        try:
+            await zk_instance.create_socket()
+            print(ip, "Device Info:", await zk_instance.get_info())
+        except ZKError as e:
+            print(e.toast())
+        finally:
+            if zk_instance.connection_type:
+                await zk_instance.disconnect()
+
+    async def test():
+        await asyncio.gather(*(poll(ip) for ip in ["192.168.1.235", "192.168.1.236"]))
+
+    asyncio.run(test())
@@ -0,0 +1,396 @@
+import asyncio
+import struct
+from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK, USHRT_MAX, WRITE_CHUNK
+from zk_util import PacketCodec, remove_tcp_header, decode_users_72, decode_records_40, decode_record_data_40, check_not_event_tcp, decode_free_sizes, encode_users_72
+from zk_records import AttendanceColumns, RecordView, RecordStream, TemplateStream
+
+class AsyncJTCP:
+    def __init__(self, ip, port, timeout=10, pipeline_depth=4):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.pipeline_depth = pipeline_depth
+        self.session_id = 0
+        self.reply_id = 0
+        self.codec = PacketCodec(True)
+        self.reader = None
+        self.writer = None
+
+    async def create_socket(self):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.timeout)
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            print("Socket error:", e)
+            return False
+
+    async def connect(self):
+        try:
+            reply = await self.execute_cmd(COMMANDS['CMD_CONNECT'], b'')
+            if reply:
+                return True
+            else:
+                raise Exception('NO_REPLY_ON_CMD_CONNECT')
+        except Exception as e:
+            print("Connection error:", e)
+            return False
+
+    async def close_socket(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = None
+            self.writer = None
+
+    async def read_reply(self):
+        # One framed packet: 8-byte 0x5050827d prefix carrying the payload length.
+        prefix = await self.reader.readexactly(8)
+        if prefix[:4] != b'\x50\x50\x82\x7d':
+            raise Exception('INVALID_TCP_PREFIX')
+        payload_size = struct.unpack('<I', prefix[4:8])[0]
+        return prefix + await self.reader.readexactly(payload_size)
+
+    async def read_command_reply(self):
+        while True:
+            reply = await self.read_reply()
+            if not check_not_event_tcp(reply):
+                return reply
+
+    async def read_within(self, read):
+        # A timeout can fall between a frame's prefix and its body; the rest of
+        # the stream is drained so the next command starts on a frame boundary.
+        try:
+            return await asyncio.wait_for(read, self.timeout)
+        except asyncio.TimeoutError:
+            await self.drain()
+            raise
+
+    async def write_message(self, msg, connect=False):
+        try:
+            self.writer.write(msg)
+            await self.writer.drain()
+            return await self.read_within(self.read_command_reply())
+        except asyncio.TimeoutError:
+            print("Timeout on writing message.")
+            return None
+
+    async def request_data(self, msg):
+        try:
+            self.writer.write(msg)
+            await self.writer.drain()
+            return await self.read_within(self.read_command_reply())
+        except asyncio.TimeoutError:
+            print("Timeout on receiving data.")
+            return None
+
+    def encode_packet(self, command, data=b''):
+        self.codec.session_id = self.session_id
+        return self.codec.encode(command, self.reply_id, data)
+
+    async def execute_cmd(self, command, data):
+        if command == COMMANDS['CMD_CONNECT']:
+            self.session_id = 0
+            self.reply_id = 0
+        else:
+            self.reply_id += 1
+
+        buf = self.encode_packet(command, data)
+        reply = await self.write_message(buf, command == COMMANDS['CMD_CONNECT'] or command == COMMANDS['CMD_EXIT'])
+
+        if reply:
+            r_reply = remove_tcp_header(reply)
+            if r_reply and len(r_reply) > 0:
+                if command == COMMANDS['CMD_CONNECT']:
+                    self.session_id = struct.unpack('<H', r_reply[4:6])[0]
+                return r_reply
+        return None
+
+    async def send_chunk_request(self, start, size):
+        self.reply_id += 1
+        req_data = struct.pack('<II', start, size)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_RDY'], req_data)
+        self.writer.write(buf)
+        await self.writer.drain()
+
+    async def drain(self, quiet=0.5):
+        try:
+            while await asyncio.wait_for(self.reader.read(65536), quiet):
+                pass
+        except asyncio.TimeoutError:
+            pass
+
+    async def read_chunks(self, view, depth, base=0):
+        # Keeps up to `depth` CMD_DATA_RDY requests in flight; see JTCP.read_chunks.
+        size = len(view)
+        pending = {}
+        next_start = 0
+        # A short chunk ends the download there, but the requests already in
+        # flight are still read off the socket so their replies don't linger.
+        short = size
+        while next_start < short or pending:
+            while next_start < short and len(pending) < depth:
+                chunk_size = min(MAX_CHUNK, size - next_start)
+                await self.send_chunk_request(base + next_start, chunk_size)
+                pending[(self.reply_id + 1) % USHRT_MAX] = [next_start, chunk_size, 0, False]
+                next_start += chunk_size
+
+            reply = await self.read_within(self.read_reply())
+            command_id, _, _, reply_id = struct.unpack('<HHHH', reply[8:16])
+            if command_id == COMMANDS['CMD_REG_EVENT']:
+                continue
+            if reply_id not in pending:
+                reply_id = next(iter(pending))
+            chunk = pending[reply_id]
+            start, chunk_size, received, prepared = chunk
+
+            if command_id == COMMANDS['CMD_DATA']:
+                body_size = len(reply) - 16
+                if received + body_size > chunk_size:
+                    raise Exception('CHUNK_OVERFLOW')
+                offset = start + received
+                view[offset:offset + body_size] = memoryview(reply)[16:]
+                chunk[2] = received = received + body_size
+                if not prepared and received >= chunk_size:
+                    del pending[reply_id]
+            elif command_id == COMMANDS['CMD_PREPARE_DATA']:
+                chunk[3] = True
+            elif command_id == COMMANDS['CMD_ACK_OK']:
+                del pending[reply_id]
+                if received != chunk_size:
+                    short = min(short, start + received)
+            else:
+                raise Exception(f'UNEXPECTED_REPLY_ON_CMD_DATA_RDY: {command_id}')
+        return short
+
+    async def read_with_buffer(self, req_data, cb=None):
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = await self.request_data(buf)
+
+        if reply:
+            header = self.codec.decode_header(reply)
+            if header.command_id == COMMANDS['CMD_DATA']:
+                return {'data': memoryview(reply)[16:], 'mode': 8}
+            elif header.command_id in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+                size = struct.unpack('<I', reply[17:21])[0]
+
+                # One allocation for the whole download; chunks land in place.
+                reply_data = memoryview(bytearray(size))
+
+                depth = max(1, self.pipeline_depth)
+                try:
+                    received = await self.read_chunks(reply_data, depth)
+                except Exception as err:
+                    if depth == 1 or isinstance(err, (ConnectionError, asyncio.IncompleteReadError)):
+                        raise
+                    # The firmware can't queue chunk requests: resync and retry lock-step.
+                    print(f"Pipelined read failed ({err!r}), falling back to lock-step.")
+                    self.pipeline_depth = 1
+                    await self.drain()
+                    await self.free_data()
+                    return await self.read_with_buffer(req_data, cb)
+
+                if received != size:
+                    return {'data': reply_data[:received], 'err': 'INCOMPLETE_CHUNK'}
+                return {'data': reply_data, 'err': None}
+        return None
+
+    async def iter_buffer(self, req_data):
+        # Streams the download in order; see JTCP.iter_buffer.
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = await self.request_data(buf)
+        if not reply:
+            return
+
+        header = self.codec.decode_header(reply)
+        if header.command_id == COMMANDS['CMD_DATA']:
+            yield memoryview(reply)[16:]
+            return
+        if header.command_id not in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            return
+
+        size = struct.unpack('<I', reply[17:21])[0]
+        window = memoryview(bytearray(min(size, max(1, self.pipeline_depth) * MAX_CHUNK)))
+        start = 0
+        while start < size:
+            depth = max(1, self.pipeline_depth)
+            length = min(size - start, depth * MAX_CHUNK)
+            try:
+                received = await self.read_chunks(window[:length], depth, start)
+            except Exception as err:
+                if depth == 1 or isinstance(err, (ConnectionError, asyncio.IncompleteReadError)):
+                    raise
+                print(f"Pipelined read failed ({err!r}), falling back to lock-step.")
+                self.pipeline_depth = 1
+                await self.drain()
+                continue
+            yield window[:received]
+            if received != length:
+                raise Exception('INCOMPLETE_CHUNK')
+            start += length
+
+    async def iter_attendances(self):
+        # Yields decoded records chunk by chunk while the transfer is running.
+        await self.free_data()
+        try:
+            stream = RecordStream(40, decode_records_40)
+            async for piece in self.iter_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS']):
+                records = stream.feed(piece)
+                if records:
+                    yield records
+        finally:
+            await self.free_data()
+
+    async def iter_templates(self):
+        # Yields (uid, fid, valid, template) batches as the transfer runs.
+        await self.free_data()
+        try:
+            stream = TemplateStream()
+            async for piece in self.iter_buffer(REQUEST_DATA['GET_TEMPLATES']):
+                templates = stream.feed(piece)
+                if templates:
+                    yield templates
+        finally:
+            await self.free_data()
+
+    async def get_users(self):
+        await self.free_data()
+        data = await self.read_with_buffer(REQUEST_DATA['GET_USERS'])
+        await self.free_data()
+
+        users = decode_users_72(data['data'][4:])
+
+        return {'data': users}
+
+    async def get_user_checksum(self):
+        # Has the device prepare the user buffer and checksum it, without transferring it.
+        await self.free_data()
+        try:
+            self.reply_id += 1
+            buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], REQUEST_DATA['GET_USERS'])
+            if not await self.request_data(buf):
+                return None
+            reply = await self.execute_cmd(COMMANDS['CMD_CHECKSUM_BUFFER'], b'')
+            if not reply or len(reply) < 12:
+                return None
+            return struct.unpack('<I', reply[8:12])[0]
+        finally:
+            await self.free_data()
+
+    async def get_attendances(self, cb=None, result='records'):
+        if cb:
+            # Streaming: cb gets each batch as it is decoded; only the count is kept.
+            count = 0
+            async for records in self.iter_attendances():
+                returned = cb(records)
+                if asyncio.iscoroutine(returned):
+                    await returned
+                count += len(records)
+            return {'data': count}
+
+        await self.free_data()
+        data = await self.read_with_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS'], cb)
+        await self.free_data()
+
+        if result == 'columns':
+            records = AttendanceColumns.from_records_40(data['data'][4:])
+        elif result == 'view':
+            records = RecordView(data['data'][4:], 40, decode_record_data_40)
+        else:
+            records = decode_records_40(data['data'][4:])
+
+        return {'data': records}
+
+    async def write_buffer(self, data):
+        # Stages data in the device buffer: CMD_PREPARE_DATA with its size, then CMD_DATA pieces.
+        reply = await self.execute_cmd(COMMANDS['CMD_PREPARE_DATA'], struct.pack('<I', len(data)))
+        if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+            raise Exception('PREPARE_DATA_REFUSED')
+        view = memoryview(data)
+        for start in range(0, len(data), WRITE_CHUNK):
+            reply = await self.execute_cmd(COMMANDS['CMD_DATA'], view[start:start + WRITE_CHUNK])
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                raise Exception('DATA_REFUSED')
+
+    async def set_users(self, users, refresh=True):
+        # One buffered transfer for the whole list; firmware that rejects the
+        # buffered CMD_USER_WRQ gets one CMD_USER_WRQ per record instead.
+        buf = encode_users_72(users)
+        await self.free_data()
+        try:
+            await self.write_buffer(buf)
+            reply = await self.execute_cmd(COMMANDS['CMD_USER_WRQ'], b'')
+            failed = []
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                view = memoryview(buf)
+                for index, user in enumerate(users):
+                    reply = await self.execute_cmd(COMMANDS['CMD_USER_WRQ'], view[index * 72:(index + 1) * 72])
+                    if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                        failed.append(user['uid'])
+            if refresh:
+                await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            await self.free_data()
+
+        if failed:
+            return {'data': len(users) - len(failed), 'failed': failed, 'err': 'USER_WRQ_FAILED'}
+        return {'data': len(users), 'err': None}
+
+    async def set_templates(self, templates, refresh=True):
+        # Each (uid, fid, valid, template) is staged with write_buffer and stored
+        # with CMD_TMP_WRITE; the device is refreshed once at the end.
+        failed = []
+        try:
+            for uid, fid, valid, template in templates:
+                try:
+                    await self.write_buffer(template)
+                except Exception:
+                    failed.append((uid, fid))
+                    continue
+                reply = await self.execute_cmd(COMMANDS['CMD_TMP_WRITE'], struct.pack('<HbbH', uid, fid, valid, len(template)))
+                if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                    failed.append((uid, fid))
+                await self.free_data()
+            if refresh:
+                await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            await self.free_data()
+
+        if failed:
+            return {'data': len(templates) - len(failed), 'failed': failed, 'err': 'TMP_WRITE_FAILED'}
+        return {'data': len(templates), 'err': None}
+
+    async def delete_users(self, uids, refresh=True):
+        failed = []
+        for uid in uids:
+            reply = await self.execute_cmd(COMMANDS['CMD_DELETE_USER'], struct.pack('<H', uid))
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                failed.append(uid)
+        if refresh:
+            await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+
+        if failed:
+            return {'data': len(uids) - len(failed), 'failed': failed, 'err': 'DELETE_USER_FAILED'}
+        return {'data': len(uids), 'err': None}
+
+    async def free_data(self):
+        await self.execute_cmd(COMMANDS['CMD_FREE_DATA'], b'')
+
+    async def disable_device(self):
+        await self.execute_cmd(COMMANDS['CMD_DISABLEDEVICE'], REQUEST_DATA['DISABLE_DEVICE'])
+
+    async def enable_device(self):
+        await self.execute_cmd(COMMANDS['CMD_ENABLEDEVICE'], b'')
+
+    async def disconnect(self):
+        await self.execute_cmd(COMMANDS['CMD_EXIT'], b'')
+        await self.close_socket()
+
+    async def get_info(self):
+        data = await self.execute_cmd(COMMANDS['CMD_GET_FREE_SIZES'], b'')
+        return decode_free_sizes(data)
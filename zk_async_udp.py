@@ -0,0 +1,434 @@
+import asyncio
+import struct
+from collections import deque
+from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK, USHRT_MAX, UDP_SEGMENT, WRITE_CHUNK
+from zk_util import PacketCodec, decode_users_28, decode_records_16, decode_record_data_16, decode_record_real_time_log_18, check_not_event_udp, decode_free_sizes, encode_users_28
+from zk_records import AttendanceColumns, RecordView, RecordStream, TemplateStream
+
+class ZKDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc):
+        self.queue.put_nowait(exc)
+
+    def connection_lost(self, exc):
+        self.queue.put_nowait(exc or ConnectionResetError('ECONNRESET'))
+
+    async def recv(self):
+        data = await self.queue.get()
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+class AsyncJUDP:
+    def __init__(self, ip, port, timeout=10, inport=0, window=16):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.inport = inport
+        self.window = window
+        self.segment_timeout = 1.0
+        self.max_retries = 5
+        self.transport = None
+        self.protocol = None
+        self.session_id = 0
+        self.reply_id = 0
+        self.codec = PacketCodec(False)
+
+    async def create_socket(self):
+        try:
+            loop = asyncio.get_running_loop()
+            self.transport, self.protocol = await loop.create_datagram_endpoint(
+                ZKDatagramProtocol, local_addr=('0.0.0.0', self.inport), remote_addr=(self.ip, self.port))
+            return True
+        except OSError as e:
+            print("Socket error:", e)
+            return False
+
+    async def connect(self):
+        try:
+            reply = await self.execute_cmd(COMMANDS['CMD_CONNECT'], b'')
+            if reply:
+                return True
+            else:
+                print("No reply on CMD_CONNECT")
+                return False
+        except Exception as e:
+            print("Connection error:", e)
+            return False
+
+    async def close_socket(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+            self.protocol = None
+
+    async def read_command_reply(self):
+        while True:
+            data = await self.protocol.recv()
+            if len(data) >= 8 and not check_not_event_udp(data):
+                return data
+
+    async def write_message(self, msg):
+        try:
+            self.transport.sendto(msg)
+            return await asyncio.wait_for(self.read_command_reply(), self.timeout)
+        except asyncio.TimeoutError:
+            print("Timeout on writing message.")
+            return None
+
+    async def request_data(self, msg):
+        try:
+            self.transport.sendto(msg)
+            return await asyncio.wait_for(self.read_command_reply(), self.timeout)
+        except asyncio.TimeoutError:
+            print("Timeout on receiving data.")
+            return None
+
+    def encode_packet(self, command, data=b''):
+        self.codec.session_id = self.session_id
+        return self.codec.encode(command, self.reply_id, data)
+
+    async def execute_cmd(self, command, data):
+        if command == COMMANDS['CMD_CONNECT']:
+            self.session_id = 0
+            self.reply_id = 0
+        else:
+            self.reply_id += 1
+
+        buf = self.encode_packet(command, data)
+        reply = await self.write_message(buf)
+
+        if reply and len(reply) > 0:
+            if command == COMMANDS['CMD_CONNECT']:
+                self.session_id = struct.unpack('<H', reply[4:6])[0]
+            return reply
+        return None
+
+    def send_chunk_request(self, start, size):
+        self.reply_id += 1
+        req_data = struct.pack('<II', start, size)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_RDY'], req_data)
+        self.transport.sendto(buf)
+
+    async def drain(self, quiet=0):
+        # Discards datagrams until none arrives for `quiet` seconds; see JUDP.drain.
+        while not self.protocol.queue.empty():
+            self.protocol.queue.get_nowait()
+        if quiet:
+            try:
+                while True:
+                    await asyncio.wait_for(self.protocol.recv(), quiet)
+            except asyncio.TimeoutError:
+                pass
+
+    async def read_window(self, view, base=0):
+        # Sliding-window download with selective retransmit; see JUDP.read_window.
+        loop = asyncio.get_running_loop()
+        size = len(view)
+        queue = deque((start, min(UDP_SEGMENT, size - start)) for start in range(0, size, UDP_SEGMENT))
+        pending = {}
+        acks = {}
+        acked = set()
+        issued = set()
+        retries = {}
+
+        while queue or pending or acks:
+            while queue and len(pending) < max(1, self.window):
+                start, length = queue.popleft()
+                self.send_chunk_request(base + start, length)
+                reply_id = (self.reply_id + 1) % USHRT_MAX
+                issued.add(reply_id)
+                pending[reply_id] = [start, length, 0, loop.time() + self.segment_timeout]
+
+            expires = min([segment[3] for segment in pending.values()] + list(acks.values()))
+            try:
+                data = await asyncio.wait_for(self.protocol.recv(), max(expires - loop.time(), 0.001))
+            except asyncio.TimeoutError:
+                data = b''
+
+            failed = []
+            if len(data) >= 8:
+                command_id, _, _, reply_id = struct.unpack('<HHHH', data[:8])
+                if reply_id not in issued and command_id != COMMANDS['CMD_REG_EVENT']:
+                    # The firmware doesn't echo reply ids, so only lock-step can place data.
+                    self.window = 1
+                    if command_id == COMMANDS['CMD_ACK_OK'] and acks:
+                        reply_id = next(iter(acks))
+                    elif len(pending) == 1:
+                        reply_id = next(iter(pending))
+                segment = pending.get(reply_id)
+                if segment and command_id == COMMANDS['CMD_DATA']:
+                    start, length, received, _ = segment
+                    body = min(len(data) - 8, length - received)
+                    view[start + received:start + received + body] = memoryview(data)[8:8 + body]
+                    segment[2] = received + body
+                    if segment[2] >= length:
+                        del pending[reply_id]
+                        if reply_id in acked:
+                            acked.discard(reply_id)
+                        else:
+                            acks[reply_id] = loop.time() + self.segment_timeout
+                elif command_id == COMMANDS['CMD_ACK_OK']:
+                    if acks.pop(reply_id, None) is None and reply_id in issued:
+                        acked.add(reply_id)
+                elif segment and command_id not in [COMMANDS['CMD_PREPARE_DATA'], COMMANDS['CMD_ACK_OK']]:
+                    failed.append(reply_id)
+
+            now = loop.time()
+            for reply_id in [reply_id for reply_id, expires in acks.items() if expires <= now]:
+                del acks[reply_id]
+            # A refused segment may have expired as well: retry it once.
+            failed += [reply_id for reply_id, segment in pending.items() if segment[3] <= now and reply_id not in failed]
+            for reply_id in failed:
+                start, length, received, _ = pending.pop(reply_id)
+                start, length = start + received, length - received
+                retries[start] = retries.get(start, 0) + 1
+                if retries[start] > self.max_retries:
+                    await self.drain(self.segment_timeout)
+                    return min([start] + [s[0] + s[2] for s in pending.values()] + [q[0] for q in queue])
+                queue.appendleft((start, length))
+
+        await self.drain()
+        return size
+
+    async def read_with_buffer(self, req_data, cb=None):
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = await self.request_data(buf)
+
+        if reply:
+            header = self.codec.decode_header(reply)
+            if header.command_id == COMMANDS['CMD_DATA']:
+                return {'data': memoryview(reply)[8:], 'mode': 8}
+            elif header.command_id in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+                size = struct.unpack('<I', reply[9:13])[0]
+
+                # One allocation for the whole download; segments land in place.
+                total_buffer = memoryview(bytearray(size))
+                received = await self.read_window(total_buffer)
+
+                if received != size:
+                    return {'data': total_buffer[:received], 'err': 'INCOMPLETE_CHUNK'}
+                return {'data': total_buffer, 'err': None}
+        return None
+
+    async def iter_buffer(self, req_data):
+        # Streams the download in order, one MAX_CHUNK piece at a time. Each piece
+        # is a view into one reused buffer, valid until the next piece is requested.
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = await self.request_data(buf)
+        if not reply:
+            return
+
+        header = self.codec.decode_header(reply)
+        if header.command_id == COMMANDS['CMD_DATA']:
+            yield memoryview(reply)[8:]
+            return
+        if header.command_id not in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            return
+
+        size = struct.unpack('<I', reply[9:13])[0]
+        window = memoryview(bytearray(min(size, MAX_CHUNK)))
+        for start in range(0, size, MAX_CHUNK):
+            length = min(MAX_CHUNK, size - start)
+            received = await self.read_window(window[:length], start)
+            yield window[:received]
+            if received != length:
+                raise Exception('INCOMPLETE_CHUNK')
+
+    async def iter_attendances(self):
+        # Yields decoded records chunk by chunk while the transfer is running.
+        await self.free_data()
+        try:
+            stream = RecordStream(16, decode_records_16)
+            async for piece in self.iter_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS']):
+                records = stream.feed(piece)
+                if records:
+                    yield records
+        finally:
+            await self.free_data()
+
+    async def iter_templates(self):
+        # Yields (uid, fid, valid, template) batches as the transfer runs.
+        await self.free_data()
+        try:
+            stream = TemplateStream()
+            async for piece in self.iter_buffer(REQUEST_DATA['GET_TEMPLATES']):
+                templates = stream.feed(piece)
+                if templates:
+                    yield templates
+        finally:
+            await self.free_data()
+
+    async def get_users(self):
+        await self.free_data()
+        data = await self.read_with_buffer(REQUEST_DATA['GET_USERS'])
+        await self.free_data()
+
+        users = decode_users_28(data['data'][4:])
+
+        return {'data': users}
+
+    async def get_user_checksum(self):
+        # Has the device prepare the user buffer and checksum it, without transferring it.
+        await self.free_data()
+        try:
+            self.reply_id += 1
+            buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], REQUEST_DATA['GET_USERS'])
+            if not await self.request_data(buf):
+                return None
+            reply = await self.execute_cmd(COMMANDS['CMD_CHECKSUM_BUFFER'], b'')
+            if not reply or len(reply) < 12:
+                return None
+            return struct.unpack('<I', reply[8:12])[0]
+        finally:
+            await self.free_data()
+
+    async def get_attendances(self, cb=None, result='records'):
+        if cb:
+            # Streaming: cb gets each batch as it is decoded; only the count is kept.
+            count = 0
+            async for records in self.iter_attendances():
+                returned = cb(records)
+                if asyncio.iscoroutine(returned):
+                    await returned
+                count += len(records)
+            return {'data': count}
+
+        await self.free_data()
+        data = await self.read_with_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS'], cb)
+        await self.free_data()
+
+        if result == 'columns':
+            records = AttendanceColumns.from_records_16(data['data'][4:])
+        elif result == 'view':
+            records = RecordView(data['data'][4:], 16, decode_record_data_16)
+        else:
+            records = decode_records_16(data['data'][4:])
+
+        return {'data': records}
+
+    async def write_buffer(self, data):
+        # Stages data in the device buffer: CMD_PREPARE_DATA with its size, then CMD_DATA pieces.
+        reply = await self.execute_cmd(COMMANDS['CMD_PREPARE_DATA'], struct.pack('<I', len(data)))
+        if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+            raise Exception('PREPARE_DATA_REFUSED')
+        view = memoryview(data)
+        for start in range(0, len(data), WRITE_CHUNK):
+            reply = await self.execute_cmd(COMMANDS['CMD_DATA'], view[start:start + WRITE_CHUNK])
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                raise Exception('DATA_REFUSED')
+
+    async def set_users(self, users, refresh=True):
+        # One buffered transfer for the whole list; firmware that rejects the
+        # buffered CMD_USER_WRQ gets one CMD_USER_WRQ per record instead.
+        buf = encode_users_28(users)
+        await self.free_data()
+        try:
+            await self.write_buffer(buf)
+            reply = await self.execute_cmd(COMMANDS['CMD_USER_WRQ'], b'')
+            failed = []
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                view = memoryview(buf)
+                for index, user in enumerate(users):
+                    reply = await self.execute_cmd(COMMANDS['CMD_USER_WRQ'], view[index * 28:(index + 1) * 28])
+                    if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                        failed.append(user['uid'])
+            if refresh:
+                await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            await self.free_data()
+
+        if failed:
+            return {'data': len(users) - len(failed), 'failed': failed, 'err': 'USER_WRQ_FAILED'}
+        return {'data': len(users), 'err': None}
+
+    async def set_templates(self, templates, refresh=True):
+        # Each (uid, fid, valid, template) is staged with write_buffer and stored
+        # with CMD_TMP_WRITE; the device is refreshed once at the end.
+        failed = []
+        try:
+            for uid, fid, valid, template in templates:
+                try:
+                    await self.write_buffer(template)
+                except Exception:
+                    failed.append((uid, fid))
+                    continue
+                reply = await self.execute_cmd(COMMANDS['CMD_TMP_WRITE'], struct.pack('<HbbH', uid, fid, valid, len(template)))
+                if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                    failed.append((uid, fid))
+                await self.free_data()
+            if refresh:
+                await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            await self.free_data()
+
+        if failed:
+            return {'data': len(templates) - len(failed), 'failed': failed, 'err': 'TMP_WRITE_FAILED'}
+        return {'data': len(templates), 'err': None}
+
+    async def delete_users(self, uids, refresh=True):
+        failed = []
+        for uid in uids:
+            reply = await self.execute_cmd(COMMANDS['CMD_DELETE_USER'], struct.pack('<H', uid))
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                failed.append(uid)
+        if refresh:
+            await self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+
+        if failed:
+            return {'data': len(uids) - len(failed), 'failed': failed, 'err': 'DELETE_USER_FAILED'}
+        return {'data': len(uids), 'err': None}
+
+    async def free_data(self):
+        await self.execute_cmd(COMMANDS['CMD_FREE_DATA'], b'')
+
+    async def disable_device(self):
+        await self.execute_cmd(COMMANDS['CMD_DISABLEDEVICE'], REQUEST_DATA['DISABLE_DEVICE'])
+
+    async def enable_device(self):
+        await self.execute_cmd(COMMANDS['CMD_ENABLEDEVICE'], b'')
+
+    async def disconnect(self):
+        await self.execute_cmd(COMMANDS['CMD_EXIT'], b'')
+        await self.close_socket()
+
+    async def get_time(self):
+        try:
+            t = await self.execute_cmd(COMMANDS['CMD_GET_TIME'], b'')
+            return struct.unpack('<I', t[8:12])[0]
+        except Exception as e:
+            print("Error getting time:", e)
+            return None
+
+    async def clear_attendance_log(self):
+        return await self.execute_cmd(COMMANDS['CMD_CLEAR_ATTLOG'], b'')
+
+    async def get_real_time_logs(self, cb=None):
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_REG_EVENT'], REQUEST_DATA['GET_REAL_TIME_EVENT'])
+        self.transport.sendto(buf)
+
+        while True:
+            data = await self.protocol.recv()
+            if not check_not_event_udp(data):
+                continue
+            if len(data) == 18:
+                result = cb(decode_record_real_time_log_18(data))
+                if asyncio.iscoroutine(result):
+                    await result
+
+    async def get_info(self):
+        try:
+            data = await self.execute_cmd(COMMANDS['CMD_GET_FREE_SIZES'], b'')
+            if data:
+                return decode_free_sizes(data)
+        except Exception as err:
+            print(f"Error getting info: {err}")
+            return None
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+
+class UserCache:
+    """
+    Decoded user tables cached per device IP and validated by checksum.
+
+    Before downloading, the device is asked for the checksum of its prepared
+    user buffer (CMD_CHECKSUM_BUFFER); when it matches the cached entry the
+    cached table is returned without transferring it. With `path` the cache
+    is also kept as a JSON snapshot on disk, and entries younger than
+    `max_age` seconds are trusted without asking the device at all.
+    """
+    def __init__(self, path=None, max_age=0):
+        self.path = path
+        self.max_age = max_age
+        self.entries = self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading user cache from {self.path}: {e}")
+            return {}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self, ip=None):
+        if ip is None:
+            self.entries = {}
+        else:
+            self.entries.pop(ip, None)
+        self.save()
+
+    def fresh(self, ip):
+        entry = self.entries.get(ip)
+        if entry and self.max_age and time.time() - entry['time'] < self.max_age:
+            return entry
+        return None
+
+    def validate(self, ip, checksum):
+        entry = self.entries.get(ip)
+        if entry and checksum is not None and entry['checksum'] == checksum:
+            entry['time'] = time.time()
+            self.save()
+            return entry
+        return None
+
+    def store(self, ip, checksum, users):
+        self.entries[ip] = {'checksum': checksum, 'time': time.time(), 'users': users}
+        self.save()
+
+    def get_users(self, zk):
+        entry = self.fresh(zk.ip)
+        if entry:
+            return {'data': entry['users'], 'cached': True}
+
+        checksum = zk.get_user_checksum()
+        entry = self.validate(zk.ip, checksum)
+        if entry:
+            return {'data': entry['users'], 'cached': True}
+
+        users = zk.get_users()['data']
+        self.store(zk.ip, checksum, users)
+        return {'data': users, 'cached': False}
+
+    async def get_users_async(self, zk):
+        entry = self.fresh(zk.ip)
+        if entry:
+            return {'data': entry['users'], 'cached': True}
+
+        checksum = await zk.get_user_checksum()
+        entry = self.validate(zk.ip, checksum)
+        if entry:
+            return {'data': entry['users'], 'cached': True}
+
+        users = (await zk.get_users())['data']
+        self.store(zk.ip, checksum, users)
+        return {'data': users, 'cached': False}
+
+
+# Example usage
+if __name__ == "__main__":
+    from zk_main import ZKLIB
+    from handler import ZKError
+
+    zk_instance = ZKLIB("192.168.1.235", 4370, 10)
+    cache = UserCache('users.json')
+    try:
+        zk_instance.create_socket()
+        users = cache.get_users(zk_instance)
+        print("Users:", len(users['data']), "from cache:", users['cached'])
+    except ZKError as e:
+        print(e.toast())
+    finally:
+        if zk_instance.connection_type:
+            zk_instance.disconnect()
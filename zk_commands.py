@@ -100,9 +100,16 @@ USHRT_MAX = 65535
 
 MAX_CHUNK = 65472
 
+# Largest CMD_DATA payload a device puts in one UDP datagram
+UDP_SEGMENT = 1024
+
+# CMD_DATA payload size when writing a buffer to the device
+WRITE_CHUNK = 1024
+
 REQUEST_DATA = {
     'DISABLE_DEVICE': bytes([0, 0, 0, 0]),
     'GET_REAL_TIME_EVENT': bytes([0x01, 0x00, 0x00, 0x00]),
     'GET_ATTENDANCE_LOGS': bytes([0x01, 0x0d, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
     'GET_USERS': bytes([0x01, 0x09, 0x00, 0x05, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+    'GET_TEMPLATES': bytes([0x01, 0x07, 0x00, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
 }
@@ -0,0 +1,165 @@
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from handler import ZKError, ERROR_TYPES
+from zk_main import ZKLIB
+from zk_async_main import AsyncZKLIB
+
+class ZKFleet:
+    """
+    Runs the same command across many devices with bounded concurrency.
+
+    `devices` is a list of IPs or of dicts with 'ip' and optionally 'port'.
+    Each command connects, runs and disconnects per device, with at most
+    `concurrency` devices in flight and `deadline` seconds allowed per
+    device, so a dead terminal only costs its own slot. The 'asyncio' backend
+    drives AsyncZKLIB instances on one event loop; the 'thread' backend runs
+    ZKLIB instances on a thread pool. Results come back as
+    {'data': {ip: result}, 'err': {ip: ZKError}}.
+    """
+    def __init__(self, devices, concurrency=16, deadline=30, backend='asyncio', timeout=10):
+        if backend not in ['asyncio', 'thread']:
+            raise ValueError(f"Unknown fleet backend: {backend}")
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.backend = backend
+        self.states = {}
+        for device in devices:
+            if isinstance(device, str):
+                device = {'ip': device}
+            ip = device['ip']
+            port = device.get('port', 4370)
+            # inport=0: a fixed UDP port can only be bound by one instance at a time.
+            if backend == 'asyncio':
+                zk = AsyncZKLIB(ip, port, min(timeout, deadline), 0)
+            else:
+                zk = ZKLIB(ip, port, min(timeout, deadline), 0)
+            self.states[ip] = {'zk': zk, 'last_ok': None, 'last_error': None, 'failures': 0, 'elapsed': None}
+
+    def record(self, ip, started, results, errors, result=None, error=None):
+        state = self.states[ip]
+        state['elapsed'] = time.monotonic() - started
+        if error is None:
+            state['last_ok'] = time.time()
+            state['last_error'] = None
+            state['failures'] = 0
+            results[ip] = result
+        else:
+            state['last_error'] = error
+            state['failures'] += 1
+            errors[ip] = error
+
+    def call(self, zk, command, args, kwargs):
+        zk.create_socket()
+        try:
+            return getattr(zk, command)(*args, **kwargs)
+        finally:
+            try:
+                zk.disconnect()
+            except Exception as err:
+                print(f"Error disconnecting {zk.ip}: {err}")
+
+    def abort(self, zk):
+        # Wakes a worker blocked in recv once its deadline has passed.
+        for sock in [zk.jtcp.socket, zk.judp.socket]:
+            if sock:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def run_threaded(self, ip, command, args, kwargs, results, errors):
+        zk = self.states[ip]['zk']
+        started = time.monotonic()
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self.abort(zk)
+
+        timer = threading.Timer(self.deadline, expire)
+        timer.start()
+        try:
+            result = self.call(zk, command, args, kwargs)
+            if expired.is_set():
+                raise ZKError(ERROR_TYPES.ETIMEDOUT, command, ip)
+            self.record(ip, started, results, errors, result)
+        except Exception as err:
+            if expired.is_set():
+                err = ZKError(ERROR_TYPES.ETIMEDOUT, command, ip)
+            elif not isinstance(err, ZKError):
+                err = ZKError(err, command, ip)
+            zk.jtcp.close_socket()
+            zk.judp.close_socket()
+            zk.connection_type = None
+            self.record(ip, started, results, errors, error=err)
+        finally:
+            timer.cancel()
+
+    async def call_async(self, zk, command, args, kwargs):
+        await zk.create_socket()
+        try:
+            return await getattr(zk, command)(*args, **kwargs)
+        finally:
+            try:
+                await zk.disconnect()
+            except Exception as err:
+                print(f"Error disconnecting {zk.ip}: {err}")
+
+    async def run_one_async(self, semaphore, ip, command, args, kwargs, results, errors):
+        zk = self.states[ip]['zk']
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(self.call_async(zk, command, args, kwargs), self.deadline)
+                self.record(ip, started, results, errors, result)
+            except asyncio.TimeoutError:
+                await zk.jtcp.close_socket()
+                await zk.judp.close_socket()
+                zk.connection_type = None
+                self.record(ip, started, results, errors, error=ZKError(ERROR_TYPES.ETIMEDOUT, command, ip))
+            except ZKError as err:
+                self.record(ip, started, results, errors, error=err)
+            except Exception as err:
+                self.record(ip, started, results, errors, error=ZKError(err, command, ip))
+
+    async def run_async(self, command, *args, ips=None, **kwargs):
+        # `ips` limits the run to a subset of the fleet, e.g. the devices to retry.
+        if self.backend != 'asyncio':
+            raise ValueError("run_async() needs the asyncio backend")
+        results, errors = {}, {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.run_one_async(semaphore, ip, command, args, kwargs, results, errors)
+                               for ip in (ips or self.states)))
+        return {'data': results, 'err': errors}
+
+    def run(self, command, *args, ips=None, **kwargs):
+        if self.backend == 'asyncio':
+            return asyncio.run(self.run_async(command, *args, ips=ips, **kwargs))
+
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for ip in (ips or self.states):
+                pool.submit(self.run_threaded, ip, command, args, kwargs, results, errors)
+        return {'data': results, 'err': errors}
+
+    def get_info(self):
+        return self.run('get_info')
+
+    def get_users(self):
+        return self.run('get_users')
+
+    def get_attendances(self, cb=None, result='records'):
+        return self.run('get_attendances', cb, result)
+
+
+# Example usage
+if __name__ == "__main__":
+    fleet = ZKFleet(["192.168.1.235", "192.168.1.236"], concurrency=8, deadline=15)
+    infos = fleet.get_info()
+    for ip, info in infos['data'].items():
+        print(ip, "Device Info:", info)
+    for ip, err in infos['err'].items():
+        print(err.toast())
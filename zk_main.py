@@ -6,10 +6,10 @@ from zk_tcp import JTCP
 from zk_udp import JUDP
 
 class ZKLIB:
-    def __init__(self, ip, port=4370, timeout=30, inport=4000):
+    def __init__(self, ip, port=4370, timeout=30, inport=4000, pipeline_depth=4, udp_window=16):
         self.connection_type = None
-        self.jtcp = JTCP(ip, port, timeout)
-        self.judp = JUDP(ip, port, timeout, inport)
+        self.jtcp = JTCP(ip, port, timeout, pipeline_depth)
+        self.judp = JUDP(ip, port, timeout, inport, udp_window)
         self.interval = None
         self.timer = None
         self.is_busy = False
@@ -111,13 +111,39 @@ class ZKLIB:
         return self.function_wrapper(self.jtcp.get_firmware, command='get_firmware')
 
     def set_user(self, uid, userid, name, password, role=0, cardno=0):
-        return self.function_wrapper(lambda: self.jtcp.set_user(uid, userid, name, password, role, cardno), command='set_user')
+        return self.set_users([{'uid': uid, 'user_id': userid, 'name': name, 'password': password, 'role': role, 'cardno': cardno}])
+
+    def set_users(self, users, refresh=True):
+        return self.function_wrapper(lambda: self.jtcp.set_users(users, refresh), lambda: self.judp.set_users(users, refresh), 'set_users')
+
+    def set_templates(self, templates, refresh=True):
+        return self.function_wrapper(lambda: self.jtcp.set_templates(templates, refresh), lambda: self.judp.set_templates(templates, refresh), 'set_templates')
+
+    def delete_users(self, uids, refresh=True):
+        return self.function_wrapper(lambda: self.jtcp.delete_users(uids, refresh), lambda: self.judp.delete_users(uids, refresh), 'delete_users')
 
     def get_attendance_size(self):
         return self.function_wrapper(self.jtcp.get_attendance_size, command='get_attendance_size')
 
-    def get_attendances(self, cb):
-        return self.function_wrapper(lambda: self.jtcp.get_attendances(cb), lambda: self.judp.get_attendances(cb), 'get_attendances')
+    def get_attendances(self, cb=None, result='records'):
+        return self.function_wrapper(lambda: self.jtcp.get_attendances(cb, result), lambda: self.judp.get_attendances(cb, result), 'get_attendances')
+
+    def get_user_checksum(self):
+        return self.function_wrapper(self.jtcp.get_user_checksum, self.judp.get_user_checksum, 'get_user_checksum')
+
+    def iter_attendances(self):
+        records = self.function_wrapper(self.jtcp.iter_attendances, self.judp.iter_attendances, 'iter_attendances')
+        try:
+            yield from records
+        except Exception as err:
+            raise ZKError(err, f"[{self.connection_type.upper()}] iter_attendances", self.ip)
+
+    def iter_templates(self):
+        templates = self.function_wrapper(self.jtcp.iter_templates, self.judp.iter_templates, 'iter_templates')
+        try:
+            yield from templates
+        except Exception as err:
+            raise ZKError(err, f"[{self.connection_type.upper()}] iter_templates", self.ip)
 
     def get_real_time_logs(self, cb):
         return self.function_wrapper(lambda: self.jtcp.get_real_time_logs(cb), lambda: self.judp.get_real_time_logs(cb), 'get_real_time_logs')
@@ -147,15 +173,17 @@ class ZKLIB:
         return self.function_wrapper(lambda: self.jtcp.execute_cmd(command, data), lambda: self.judp.execute_cmd(command, data), 'execute_cmd')
 
     def set_interval_schedule(self, cb, timer):
+        # Runs on fixed monotonic slots, so the time cb takes doesn't add drift.
         self.interval = True
+        next_run = time.monotonic()
         while self.interval:
             cb()
-            time.sleep(timer)
+            next_run += timer
+            time.sleep(max(0, next_run - time.monotonic()))
 
     def set_timer_schedule(self, cb, timer):
         self.timer = time.time() + timer
-        while time.time() < self.timer:
-            pass
+        time.sleep(timer)
         cb()
 
 
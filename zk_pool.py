@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from handler import ZKError
+from zk_commands import COMMANDS
+from zk_main import ZKLIB
+from zk_async_main import AsyncZKLIB
+
+class ZKPool:
+    """
+    Open ZKLIB sessions kept per device IP and handed out as leases.
+
+    The firmware allows one session per device, so each device has a lock
+    and a lease holds it for the whole `with` block. A session idle for more
+    than `keepalive` seconds is pinged with CMD_GET_TIME before it is handed
+    out (and by keepalive() sweeps); a session that fails the ping or raises
+    during a lease is closed and reconnected on the next lease.
+    """
+    def __init__(self, timeout=10, keepalive=30):
+        self.timeout = timeout
+        self.keepalive_interval = keepalive
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    def get_session(self, ip, port):
+        with self.lock:
+            session = self.sessions.get(ip)
+            if not session:
+                session = {'zk': ZKLIB(ip, port, self.timeout, 0), 'lock': threading.Lock(), 'last_used': 0}
+                self.sessions[ip] = session
+            return session
+
+    def connected(self, zk):
+        return (zk.connection_type == 'tcp' and zk.jtcp.socket) or (zk.connection_type == 'udp' and zk.judp.socket)
+
+    def ping(self, zk):
+        try:
+            return zk.execute_cmd(COMMANDS['CMD_GET_TIME'], b'') is not None
+        except ZKError:
+            return False
+
+    def close(self, zk, exit=True):
+        if exit and self.connected(zk):
+            try:
+                zk.disconnect()
+            except Exception as err:
+                print(f"Error disconnecting {zk.ip}: {err}")
+        zk.jtcp.close_socket()
+        zk.judp.close_socket()
+        zk.connection_type = None
+
+    @contextmanager
+    def lease(self, ip, port=4370):
+        session = self.get_session(ip, port)
+        with session['lock']:
+            zk = session['zk']
+            if self.connected(zk) and time.monotonic() - session['last_used'] > self.keepalive_interval:
+                if not self.ping(zk):
+                    print(f"Session to {ip} is dead, reconnecting.")
+                    self.close(zk, False)
+            if not self.connected(zk):
+                zk.create_socket()
+            try:
+                yield zk
+            except Exception:
+                # The session may be left mid-transfer; don't reuse it.
+                self.close(zk, False)
+                raise
+            finally:
+                session['last_used'] = time.monotonic()
+
+    def keepalive(self):
+        # Pings idle sessions; a busy device is skipped rather than waited for.
+        for ip, session in list(self.sessions.items()):
+            if not session['lock'].acquire(blocking=False):
+                continue
+            try:
+                zk = session['zk']
+                if self.connected(zk) and time.monotonic() - session['last_used'] > self.keepalive_interval:
+                    if self.ping(zk):
+                        session['last_used'] = time.monotonic()
+                    else:
+                        print(f"Session to {ip} is dead, closing.")
+                        self.close(zk, False)
+            finally:
+                session['lock'].release()
+
+    def start(self):
+        def loop():
+            while self.running:
+                time.sleep(self.keepalive_interval / 2)
+                self.keepalive()
+
+        self.running = True
+        self.thread = threading.Thread(target=loop, daemon=True)
+        self.thread.start()
+
+    def close_all(self):
+        self.running = False
+        for session in list(self.sessions.values()):
+            with session['lock']:
+                self.close(session['zk'])
+        self.sessions = {}
+
+class AsyncZKPool:
+    """
+    ZKPool for AsyncZKLIB sessions: the same leases, pings and per-device
+    locking, on one event loop.
+    """
+    def __init__(self, timeout=10, keepalive=30):
+        self.timeout = timeout
+        self.keepalive_interval = keepalive
+        self.sessions = {}
+        self.task = None
+
+    def get_session(self, ip, port):
+        session = self.sessions.get(ip)
+        if not session:
+            session = {'zk': AsyncZKLIB(ip, port, self.timeout, 0), 'lock': asyncio.Lock(), 'last_used': 0}
+            self.sessions[ip] = session
+        return session
+
+    def connected(self, zk):
+        return (zk.connection_type == 'tcp' and zk.jtcp.writer) or (zk.connection_type == 'udp' and zk.judp.transport)
+
+    async def ping(self, zk):
+        try:
+            return await zk.execute_cmd(COMMANDS['CMD_GET_TIME'], b'') is not None
+        except ZKError:
+            return False
+
+    async def close(self, zk, exit=True):
+        if exit and self.connected(zk):
+            try:
+                await zk.disconnect()
+            except Exception as err:
+                print(f"Error disconnecting {zk.ip}: {err}")
+        await zk.jtcp.close_socket()
+        await zk.judp.close_socket()
+        zk.connection_type = None
+
+    @asynccontextmanager
+    async def lease(self, ip, port=4370):
+        session = self.get_session(ip, port)
+        async with session['lock']:
+            zk = session['zk']
+            if self.connected(zk) and time.monotonic() - session['last_used'] > self.keepalive_interval:
+                if not await self.ping(zk):
+                    print(f"Session to {ip} is dead, reconnecting.")
+                    await self.close(zk, False)
+            if not self.connected(zk):
+                await zk.create_socket()
+            try:
+                yield zk
+            except BaseException:
+                await self.close(zk, False)
+                raise
+            finally:
+                session['last_used'] = time.monotonic()
+
+    async def keepalive(self):
+        for ip, session in list(self.sessions.items()):
+            if session['lock'].locked():
+                continue
+            async with session['lock']:
+                zk = session['zk']
+                if self.connected(zk) and time.monotonic() - session['last_used'] > self.keepalive_interval:
+                    if await self.ping(zk):
+                        session['last_used'] = time.monotonic()
+                    else:
+                        print(f"Session to {ip} is dead, closing.")
+                        await self.close(zk, False)
+
+    def start(self):
+        async def loop():
+            while True:
+                await asyncio.sleep(self.keepalive_interval / 2)
+                await self.keepalive()
+
+        self.task = asyncio.get_running_loop().create_task(loop())
+
+    async def close_all(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for session in list(self.sessions.values()):
+            async with session['lock']:
+                await self.close(session['zk'])
+        self.sessions = {}
+
+
+# Example usage
+if __name__ == "__main__":
+    pool = ZKPool(timeout=10, keepalive=30)
+    pool.start()
+    try:
+        for _ in range(3):
+            with pool.lease("192.168.1.235") as zk_instance:
+                print("Device Info:", zk_instance.get_info())
+            time.sleep(5)
+    except ZKError as e:
+        print(e.toast())
+    finally:
+        pool.close_all()
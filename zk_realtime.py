@@ -0,0 +1,231 @@
+import selectors
+import socket
+import struct
+import time
+from zk_commands import COMMANDS, REQUEST_DATA, USHRT_MAX
+from zk_util import PacketCodec, TCP_MAGIC, UDP_HEADER, decode_record_real_time_log_18, decode_record_real_time_log_52
+
+class RealTimeDevice:
+    def __init__(self, ip, port, tcp, handler):
+        self.ip = ip
+        self.port = port
+        self.tcp = tcp
+        self.handler = handler
+        self.codec = PacketCodec(tcp)
+        self.socket = None
+        self.state = 'idle'
+        self.buffer = bytearray()
+        self.reply_id = 0
+        self.deadline = None
+        self.retry_at = 0
+        self.events = 0
+
+class RealTimeMonitor:
+    """
+    Watches real-time attendance events from many devices on one thread.
+
+    Every device gets a non-blocking socket registered with one selector.
+    CMD_CONNECT and CMD_REG_EVENT are driven as a small state machine from
+    the same loop, so a dead device costs a timer, not a blocked thread.
+    Every event is acknowledged; attendance events (EF_ATTLOG) are decoded
+    with decode_record_real_time_log_18/52 and passed to handler(ip, record). Devices that fail or drop are retried
+    every `retry` seconds.
+    """
+    def __init__(self, timeout=10, retry=30, handler=None):
+        self.timeout = timeout
+        self.retry = retry
+        self.handler = handler
+        self.selector = selectors.DefaultSelector()
+        self.devices = {}
+        self.running = False
+
+    def add(self, ip, port=4370, handler=None, tcp=False):
+        device = RealTimeDevice(ip, port, tcp, handler or self.handler)
+        self.devices[ip] = device
+        self.open(device)
+        return device
+
+    def remove(self, ip):
+        device = self.devices.pop(ip, None)
+        if device:
+            self.close(device, True)
+
+    def open(self, device):
+        device.buffer = bytearray()
+        device.codec.session_id = 0
+        device.reply_id = 0
+        device.deadline = time.monotonic() + self.timeout
+        try:
+            device.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM if device.tcp else socket.SOCK_DGRAM)
+            device.socket.setblocking(False)
+            if device.tcp:
+                device.socket.connect_ex((device.ip, device.port))
+                device.state = 'connecting'
+                self.selector.register(device.socket, selectors.EVENT_WRITE, device)
+            else:
+                device.socket.connect((device.ip, device.port))
+                self.selector.register(device.socket, selectors.EVENT_READ, device)
+                self.send(device, COMMANDS['CMD_CONNECT'])
+                device.state = 'handshake'
+        except OSError as err:
+            self.fail(device, err)
+
+    def close(self, device, exit=False):
+        if device.socket:
+            if exit and device.state == 'live':
+                try:
+                    self.send(device, COMMANDS['CMD_EXIT'])
+                except OSError:
+                    pass
+            try:
+                self.selector.unregister(device.socket)
+            except (KeyError, ValueError):
+                pass
+            device.socket.close()
+            device.socket = None
+        device.state = 'idle'
+
+    def fail(self, device, reason):
+        print(f"Real-time session to {device.ip} failed ({reason}), retrying in {self.retry}s.")
+        self.close(device)
+        device.retry_at = time.monotonic() + self.retry
+
+    def send(self, device, command, data=b'', reply_id=None):
+        if reply_id is None:
+            reply_id = device.reply_id
+            device.reply_id += 1
+        device.socket.send(device.codec.encode(command, reply_id, data))
+
+    def read(self, device):
+        try:
+            data = device.socket.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            self.fail(device, err)
+            return
+        if not data:
+            self.fail(device, 'connection closed')
+            return
+
+        if not device.tcp:
+            self.handle_packet(device, data, 0)
+            return
+
+        buf = device.buffer
+        buf += data
+        while len(buf) >= 8:
+            if buf[:4] != TCP_MAGIC:
+                # Lost framing: skip to the next frame marker.
+                index = buf.find(TCP_MAGIC, 1)
+                del buf[:index if index > 0 else max(len(buf) - 3, 1)]
+                continue
+            size = struct.unpack_from('<I', buf, 4)[0]
+            if len(buf) < 8 + size:
+                break
+            frame = bytes(buf[:8 + size])
+            del buf[:8 + size]
+            self.handle_packet(device, frame, 8)
+
+    def handle_packet(self, device, packet, offset):
+        if len(packet) < offset + 8:
+            return
+        command_id, _, session_id, _ = UDP_HEADER.unpack_from(packet, offset)
+
+        if command_id == COMMANDS['CMD_REG_EVENT']:
+            self.send(device, COMMANDS['CMD_ACK_OK'], reply_id=USHRT_MAX - 1)
+            # Events carry their type in the session field; only punches are decoded.
+            if session_id == COMMANDS['EF_ATTLOG']:
+                self.dispatch(device, packet)
+        elif device.state == 'handshake':
+            if command_id in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_ACK_UNAUTH']]:
+                device.codec.session_id = session_id
+                self.send(device, COMMANDS['CMD_REG_EVENT'], REQUEST_DATA['GET_REAL_TIME_EVENT'])
+                device.state = 'registering'
+            else:
+                self.fail(device, f'CMD_CONNECT refused: {command_id}')
+        elif device.state == 'registering':
+            if command_id == COMMANDS['CMD_ACK_OK']:
+                device.state = 'live'
+                device.deadline = None
+                print(f"Listening for real-time events from {device.ip}")
+            else:
+                self.fail(device, f'CMD_REG_EVENT refused: {command_id}')
+
+    def dispatch(self, device, packet):
+        if not device.tcp and len(packet) == 18:
+            record = decode_record_real_time_log_18(packet)
+        elif len(packet) >= (52 if device.tcp else 44):
+            record = decode_record_real_time_log_52(packet)
+        else:
+            return
+        device.events += 1
+        if device.handler:
+            try:
+                device.handler(device.ip, record)
+            except Exception as err:
+                print(f"Error in real-time handler for {device.ip}: {err}")
+
+    def connected(self, device):
+        err = device.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.fail(device, OSError(err, 'connect failed'))
+            return
+        self.selector.modify(device.socket, selectors.EVENT_READ, device)
+        self.send(device, COMMANDS['CMD_CONNECT'])
+        device.state = 'handshake'
+
+    def poll(self, timeout=1.0):
+        now = time.monotonic()
+        wakeups = [d.deadline for d in self.devices.values() if d.deadline and d.state != 'idle']
+        wakeups += [d.retry_at for d in self.devices.values() if d.state == 'idle']
+        if wakeups:
+            timeout = max(0, min([timeout] + [w - now for w in wakeups]))
+
+        if self.selector.get_map():
+            ready = self.selector.select(timeout)
+        else:
+            time.sleep(timeout)
+            ready = []
+        for key, _ in ready:
+            device = key.data
+            try:
+                if device.state == 'connecting':
+                    self.connected(device)
+                else:
+                    self.read(device)
+            except OSError as err:
+                self.fail(device, err)
+
+        now = time.monotonic()
+        for device in list(self.devices.values()):
+            if device.state == 'idle':
+                if device.retry_at <= now:
+                    self.open(device)
+            elif device.deadline and device.deadline <= now:
+                self.fail(device, f'no reply while {device.state}')
+
+    def run(self, duration=None):
+        self.running = True
+        end = time.monotonic() + duration if duration else None
+        while self.running and (end is None or time.monotonic() < end):
+            self.poll(1.0 if end is None else min(1.0, max(0, end - time.monotonic())))
+
+    def stop(self):
+        self.running = False
+        for device in self.devices.values():
+            self.close(device, True)
+
+
+# Example usage
+if __name__ == "__main__":
+    def on_event(ip, record):
+        print(ip, "Real-time log:", record)
+
+    monitor = RealTimeMonitor(timeout=5, retry=30, handler=on_event)
+    for ip in ["192.168.1.235", "192.168.1.236"]:
+        monitor.add(ip)
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
@@ -0,0 +1,220 @@
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from zk_util import parse_time_to_date, whole_records
+from time1 import TimeCodec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def extract_column(view, size, offset, width):
+    # Gathers one fixed-width field from every record with strided slice copies,
+    # so no per-record Python objects are created.
+    count = len(view) // size
+    column = bytearray(count * width)
+    for k in range(width):
+        column[k::width] = view[offset + k:count * size:size]
+    return column
+
+def to_array(typecode, raw):
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+class AttendanceColumns:
+    """
+    Attendance log held column-wise.
+
+    user_sn, device_user_id and the raw encoded record time live in flat
+    arrays and a row is only decoded when it is accessed. 40-byte TCP records
+    keep device_user_id as a fixed-width 9-byte column; 16-byte UDP records
+    carry a numeric id and no user_sn. Slices share the parent's columns.
+    """
+    def __init__(self, user_sn, device_user_id, record_time, id_width=0):
+        self.user_sn = user_sn
+        self.device_user_id = device_user_id
+        self.record_time = record_time
+        self.id_width = id_width
+
+    @classmethod
+    def from_records_40(cls, buf):
+        view = whole_records(buf, 40)
+        return cls(memoryview(to_array('H', extract_column(view, 40, 0, 2))),
+                   memoryview(extract_column(view, 40, 2, 9)),
+                   memoryview(to_array('I', extract_column(view, 40, 27, 4))), 9)
+
+    @classmethod
+    def from_records_16(cls, buf):
+        view = whole_records(buf, 16)
+        return cls(None,
+                   memoryview(to_array('H', extract_column(view, 16, 0, 2))),
+                   memoryview(to_array('I', extract_column(view, 16, 4, 4))))
+
+    def __len__(self):
+        return len(self.record_time)
+
+    def get_device_user_id(self, index):
+        if self.id_width:
+            start = index * self.id_width
+            return bytes(self.device_user_id[start:start + self.id_width]).decode('ascii').split('\0')[0]
+        return self.device_user_id[index]
+
+    def row(self, index):
+        record = {}
+        if self.user_sn is not None:
+            record['user_sn'] = self.user_sn[index]
+        record['device_user_id'] = self.get_device_user_id(index)
+        record['record_time'] = parse_time_to_date(self.record_time[index])
+        return record
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            user_sn = self.user_sn[index] if self.user_sn is not None else None
+            if not self.id_width:
+                device_user_id = self.device_user_id[index]
+            elif step == 1:
+                device_user_id = self.device_user_id[start * self.id_width:max(start, stop) * self.id_width]
+            else:
+                w = self.id_width
+                device_user_id = memoryview(b''.join(self.device_user_id[i * w:(i + 1) * w] for i in range(start, stop, step)))
+            return AttendanceColumns(user_sn, device_user_id, self.record_time[index], self.id_width)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('attendance index out of range')
+        return self.row(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def epochs(self, codec=None):
+        # record_time as epoch seconds, converted in one batch.
+        return (codec or TimeCodec()).to_epochs(self.record_time)
+
+    def to_numpy(self):
+        if numpy is None:
+            raise ImportError('AttendanceColumns.to_numpy() requires NumPy')
+        columns = {}
+        if self.user_sn is not None:
+            columns['user_sn'] = numpy.asarray(self.user_sn)
+        if self.id_width:
+            columns['device_user_id'] = numpy.frombuffer(self.device_user_id, dtype=f'S{self.id_width}')
+        else:
+            columns['device_user_id'] = numpy.asarray(self.device_user_id)
+        columns['record_time'] = numpy.asarray(self.record_time)
+        return columns
+
+class RecordView(Sequence):
+    """
+    Read-only sequence over the fixed-size records of a download buffer.
+
+    Nothing is decoded up front: a record goes through `decode` only when it
+    is indexed or iterated, and slicing narrows the index range without
+    touching the buffer, so counting or reading the tail of a large log costs
+    only the transfer.
+    """
+    def __init__(self, buf, size, decode, indices=None):
+        self.view = whole_records(buf, size)
+        self.size = size
+        self.decode = decode
+        self.indices = range(len(self.view) // size) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RecordView(self.view, self.size, self.decode, self.indices[index])
+        start = self.indices[index] * self.size
+        return self.decode(self.view[start:start + self.size])
+
+    def __iter__(self):
+        view, size, decode = self.view, self.size, self.decode
+        for index in self.indices:
+            yield decode(view[index * size:(index + 1) * size])
+
+class RecordStream:
+    """
+    Decodes fixed-size records from a download that arrives in pieces.
+
+    The leading `skip` bytes (the size field in front of every buffer) are
+    dropped, and a record split across two pieces is carried over until the
+    rest of it arrives.
+    """
+    def __init__(self, size, decode, skip=4):
+        self.size = size
+        self.decode = decode
+        self.skip = skip
+        self.carry = b''
+
+    def feed(self, piece):
+        if self.skip:
+            dropped = min(self.skip, len(piece))
+            piece = piece[dropped:]
+            self.skip -= dropped
+
+        records = []
+        if self.carry:
+            head = bytes(piece[:self.size - len(self.carry)])
+            self.carry += head
+            piece = piece[len(head):]
+            if len(self.carry) < self.size:
+                return records
+            records = self.decode(self.carry)
+            self.carry = b''
+
+        whole = len(piece) - len(piece) % self.size
+        records += self.decode(piece[:whole])
+        self.carry = bytes(piece[whole:])
+        return records
+
+TEMPLATE_HEADER = struct.Struct('<HHbb')
+
+class TemplateStream:
+    """
+    Parses fingerprint template records from a download that arrives in pieces.
+
+    Each record is a 6-byte header (record size, uid, finger index, valid
+    flag) followed by the template. feed() returns (uid, fid, valid,
+    template) tuples for the records completed by a piece; only a record
+    split across pieces is kept back.
+    """
+    def __init__(self, skip=4):
+        self.skip = skip
+        self.carry = bytearray()
+
+    def feed(self, piece):
+        if self.skip:
+            dropped = min(self.skip, len(piece))
+            piece = piece[dropped:]
+            self.skip -= dropped
+
+        if self.carry:
+            self.carry += piece
+            view = memoryview(self.carry)
+        else:
+            view = memoryview(piece)
+
+        templates = []
+        offset = 0
+        while len(view) - offset >= TEMPLATE_HEADER.size:
+            size, uid, fid, valid = TEMPLATE_HEADER.unpack_from(view, offset)
+            if size < TEMPLATE_HEADER.size:
+                raise Exception('BAD_TEMPLATE_RECORD')
+            if len(view) - offset < size:
+                break
+            templates.append((uid, fid, valid, bytes(view[offset + TEMPLATE_HEADER.size:offset + size])))
+            offset += size
+
+        rest = bytes(view[offset:])
+        view.release()
+        self.carry = bytearray(rest)
+        return templates
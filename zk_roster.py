@@ -0,0 +1,148 @@
+USER_FIELDS = ['name', 'role', 'cardno', 'password']
+
+def user_key(user, key):
+    # user_id is a string on 72-byte records and a number on 28-byte ones.
+    return str(user[key])
+
+def diff_roster(desired, current, key='user_id', fields=USER_FIELDS):
+    """
+    Compare the desired roster with the users on a device.
+
+    Users are matched on `key`. A desired user missing from the device is an
+    insert and gets its own uid or the lowest free one; a user present on
+    both sides is an update when any of `fields` differs (fields the device
+    record doesn't carry are skipped); a device user missing from the
+    roster is a delete. A key repeated in the roster raises DUPLICATE_KEY;
+    on the device, the first user with a key is matched and any later ones
+    are deleted. An explicit uid on an insert may reuse the slot of a
+    deleted user (deletes are applied first) but raises UID_CONFLICT if a
+    kept user or another insert holds it. Returns {'insert': [...],
+    'update': [...], 'delete': [...]} with the user dicts to write or remove.
+    """
+    current_by_key = {}
+    for user in current:
+        current_by_key.setdefault(user_key(user, key), user)
+    desired_keys = set()
+    used_uids = {user['uid'] for user in current} | {user['uid'] for user in desired if 'uid' in user}
+    free_uid = 1
+    plan = {'insert': [], 'update': [], 'delete': []}
+
+    for user in desired:
+        user_id = user_key(user, key)
+        if user_id in desired_keys:
+            raise Exception('DUPLICATE_KEY')
+        desired_keys.add(user_id)
+        existing = current_by_key.get(user_id)
+        if existing is None:
+            record = dict(user)
+            if 'uid' not in record:
+                while free_uid in used_uids:
+                    free_uid += 1
+                if free_uid > 65535:
+                    raise Exception('NO_FREE_UID')
+                record['uid'] = free_uid
+                used_uids.add(free_uid)
+            plan['insert'].append(record)
+        elif any(field in user and field in existing and user[field] != existing[field] for field in fields):
+            record = dict(existing)
+            record.update(user)
+            record['uid'] = existing['uid']
+            plan['update'].append(record)
+
+    plan['delete'] = [user for user in current
+                      if user_key(user, key) not in desired_keys or current_by_key[user_key(user, key)] is not user]
+
+    taken = {user['uid'] for user_id, user in current_by_key.items() if user_id in desired_keys}
+    for record in plan['insert']:
+        if record['uid'] in taken:
+            raise Exception('UID_CONFLICT')
+        taken.add(record['uid'])
+    return plan
+
+def plan_summary(plan):
+    return {action: len(users) for action, users in plan.items()}
+
+def apply_roster(zk, plan):
+    # The device is disabled only while the delta is written, and refreshed once.
+    # Deletes go first so an insert can take over a freed uid.
+    writes = plan['insert'] + plan['update']
+    deletes = [user['uid'] for user in plan['delete']]
+    if not writes and not deletes:
+        return {'data': plan_summary(plan), 'err': None}
+
+    result = {'data': plan_summary(plan), 'err': None}
+    zk.disable_device()
+    try:
+        if deletes:
+            deleted = zk.delete_users(deletes, refresh=not writes)
+            if deleted['err']:
+                result['err'] = deleted['err']
+                result['failed'] = deleted['failed']
+        if writes:
+            written = zk.set_users(writes)
+            if written['err']:
+                result['err'] = result['err'] or written['err']
+                result['failed'] = result.get('failed', []) + written['failed']
+    finally:
+        zk.enable_device()
+    return result
+
+async def apply_roster_async(zk, plan):
+    writes = plan['insert'] + plan['update']
+    deletes = [user['uid'] for user in plan['delete']]
+    if not writes and not deletes:
+        return {'data': plan_summary(plan), 'err': None}
+
+    result = {'data': plan_summary(plan), 'err': None}
+    await zk.disable_device()
+    try:
+        if deletes:
+            deleted = await zk.delete_users(deletes, refresh=not writes)
+            if deleted['err']:
+                result['err'] = deleted['err']
+                result['failed'] = deleted['failed']
+        if writes:
+            written = await zk.set_users(writes)
+            if written['err']:
+                result['err'] = result['err'] or written['err']
+                result['failed'] = result.get('failed', []) + written['failed']
+    finally:
+        await zk.enable_device()
+    return result
+
+def sync_roster(zk, desired, key='user_id', dry_run=False):
+    plan = diff_roster(desired, zk.get_users()['data'], key)
+    if dry_run:
+        return {'data': plan_summary(plan), 'plan': plan, 'err': None}
+    result = apply_roster(zk, plan)
+    result['plan'] = plan
+    return result
+
+async def sync_roster_async(zk, desired, key='user_id', dry_run=False):
+    plan = diff_roster(desired, (await zk.get_users())['data'], key)
+    if dry_run:
+        return {'data': plan_summary(plan), 'plan': plan, 'err': None}
+    result = await apply_roster_async(zk, plan)
+    result['plan'] = plan
+    return result
+
+
+# Example usage
+if __name__ == "__main__":
+    from zk_main import ZKLIB
+    from handler import ZKError
+
+    roster = [
+        {'user_id': '1001', 'name': 'John Doe', 'role': 0, 'cardno': 0, 'password': ''},
+        {'user_id': '1002', 'name': 'Jane Roe', 'role': 14, 'cardno': 5120, 'password': ''},
+    ]
+    zk_instance = ZKLIB("192.168.1.235", 4370, 10)
+    try:
+        zk_instance.create_socket()
+        print("Plan:", sync_roster(zk_instance, roster, dry_run=True)['data'])
+        print("Applied:", sync_roster(zk_instance, roster))
+    except ZKError as e:
+        print(e.toast())
+    finally:
+        if zk_instance.connection_type:
+            zk_instance.disconnect()
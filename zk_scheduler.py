@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import random
+import threading
+import time
+
+class Job:
+    def __init__(self, cb, interval, next_run, jitter=0, device=None):
+        self.cb = cb
+        self.interval = interval
+        self.jitter = jitter
+        self.device = device
+        self.base = next_run
+        self.next_run = next_run + (random.uniform(0, jitter) if jitter else 0)
+        self.cancelled = False
+        self.runs = 0
+        self.missed = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    """
+    Runs many timed jobs from one heap on one thread or event loop.
+
+    Times are time.monotonic(). A repeating job keeps its slots aligned to
+    its interval; when the scheduler falls behind, the missed slots are
+    coalesced into a single run and counted in job.missed. `jitter` adds a
+    random delay of up to that many seconds to each run, so jobs created
+    together don't all hit the network at once. A job is rescheduled only
+    when its run finishes, so it never overlaps itself. Cancelled jobs are
+    dropped lazily when they reach the top of the heap.
+    """
+    def __init__(self):
+        self.heap = []
+        self.active = set()
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.notify = None
+        self.running = False
+
+    def push(self, job):
+        with self.condition:
+            self.seq += 1
+            heapq.heappush(self.heap, (job.next_run, self.seq, job))
+            self.condition.notify()
+        if self.notify:
+            self.notify()
+        return job
+
+    def every(self, interval, cb, jitter=0, device=None, delay=None):
+        first = time.monotonic() + (interval if delay is None else delay)
+        return self.push(Job(cb, interval, first, jitter, device))
+
+    def after(self, delay, cb, device=None):
+        return self.push(Job(cb, None, time.monotonic() + delay, 0, device))
+
+    def cancel(self, job):
+        job.cancel()
+
+    def cancel_device(self, device):
+        with self.condition:
+            for job in [job for _, _, job in self.heap] + list(self.active):
+                if job.device == device:
+                    job.cancel()
+
+    def jobs(self):
+        with self.condition:
+            return [job for _, _, job in self.heap if not job.cancelled] + [job for job in self.active if not job.cancelled]
+
+    def reschedule(self, job, now):
+        slots = int((now - job.base) // job.interval) + 1 if now >= job.base else 1
+        job.missed += slots - 1
+        job.base += slots * job.interval
+        job.next_run = job.base + (random.uniform(0, job.jitter) if job.jitter else 0)
+        self.push(job)
+
+    def pop_due(self, now):
+        due = []
+        with self.condition:
+            while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] <= now):
+                _, _, job = heapq.heappop(self.heap)
+                if not job.cancelled:
+                    due.append(job)
+                    self.active.add(job)
+        return due
+
+    def next_delay(self, now):
+        with self.condition:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] - now if self.heap else None
+
+    def finish(self, job, now):
+        with self.condition:
+            self.active.discard(job)
+        job.runs += 1
+        if job.interval and not job.cancelled:
+            self.reschedule(job, now)
+
+    def run_pending(self):
+        # Runs every due job once; returns seconds until the next one, or None.
+        now = time.monotonic()
+        for job in self.pop_due(now):
+            try:
+                job.cb()
+            except Exception as e:
+                print(f"Error in scheduled job {job.cb}: {e}")
+            self.finish(job, time.monotonic())
+        return self.next_delay(time.monotonic())
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.run_pending()
+            with self.condition:
+                if not self.running:
+                    break
+                delay = self.next_delay(time.monotonic())
+                if delay is None or delay > 0:
+                    self.condition.wait(delay)
+
+    async def run_job_async(self, job):
+        try:
+            result = job.cb()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            print(f"Error in scheduled job {job.cb}: {e}")
+
+    async def run_async(self):
+        # Coroutine jobs run as tasks, so a slow device doesn't hold up the others.
+        # Each job goes back on the heap when its task is done.
+        self.running = True
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self.notify = lambda: loop.call_soon_threadsafe(wake.set)
+        tasks = set()
+        try:
+            while self.running:
+                now = time.monotonic()
+                for job in self.pop_due(now):
+                    task = loop.create_task(self.run_job_async(job))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda task, job=job: self.finish(job, time.monotonic()))
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), self.next_delay(time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.notify = None
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.notify:
+            self.notify()
+
+
+class PollPolicy:
+    """
+    Per-device poll interval estimated from the observed punch rate.
+
+    Each poll reports the device's logCounts; the delta since the previous
+    poll feeds an exponentially weighted rate, and the next interval is the
+    time expected for `target` new records, clamped to [min_interval,
+    max_interval]. Idle devices back off by `backoff` per empty poll. A poll
+    that brings in more than `burst` records, or far more than the rate
+    predicted, switches the device to min_interval for the next
+    `burst_polls` polls.
+    """
+    def __init__(self, min_interval=5, max_interval=600, target=10, alpha=0.3, backoff=2, burst=50, burst_polls=3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.alpha = alpha
+        self.backoff = backoff
+        self.burst = burst
+        self.burst_polls = burst_polls
+        self.devices = {}
+
+    def observe(self, device, log_count, now=None):
+        now = time.monotonic() if now is None else now
+        state = self.devices.get(device)
+        if state is None:
+            self.devices[device] = {'count': log_count or 0, 'time': now, 'rate': 0.0, 'interval': self.min_interval, 'burst': 0}
+            return self.min_interval
+        if log_count is None:
+            # The poll failed: back off as for an idle device.
+            state['interval'] = min(self.max_interval, state['interval'] * self.backoff)
+            return state['interval']
+
+        elapsed = max(now - state['time'], 1e-3)
+        # A shrinking count means the log was cleared: count from zero.
+        delta = log_count - state['count'] if log_count >= state['count'] else log_count
+        expected = state['rate'] * elapsed
+        state['rate'] = self.alpha * (delta / elapsed) + (1 - self.alpha) * state['rate']
+        state['count'] = log_count
+        state['time'] = now
+
+        if delta >= self.burst or (delta >= self.target and delta > 4 * expected):
+            state['burst'] = self.burst_polls
+        if state['burst']:
+            state['burst'] -= 1
+            interval = self.min_interval
+        elif delta == 0:
+            interval = state['interval'] * self.backoff
+        else:
+            interval = self.target / state['rate']
+        state['interval'] = min(self.max_interval, max(self.min_interval, interval))
+        return state['interval']
+
+    def attach(self, scheduler, device, poll):
+        # Schedules poll() (returning logCounts, or a coroutine for it) and
+        # retunes the job's interval after every run. The scheduler requeues
+        # the job only once run() returns, so the new interval already sets
+        # the next poll; a poll that raises counts as failed.
+        if asyncio.iscoroutinefunction(poll):
+            async def run():
+                log_count = None
+                try:
+                    log_count = await poll()
+                finally:
+                    job.interval = self.observe(device, log_count)
+        else:
+            def run():
+                log_count = None
+                try:
+                    log_count = poll()
+                finally:
+                    job.interval = self.observe(device, log_count)
+        job = scheduler.every(self.min_interval, run, device=device, delay=0)
+        return job
+
+
+# Example usage: poll each device as often as its punch rate calls for
+if __name__ == "__main__":
+    from zk_main import ZKLIB
+    from handler import ZKError
+
+    def poll(ip):
+        zk_instance = ZKLIB(ip, 4370, 10, 0)
+        try:
+            zk_instance.create_socket()
+            info = zk_instance.get_info()
+            zk_instance.disconnect()
+            print(ip, "Device Info:", info)
+            return info['logCounts']
+        except ZKError as e:
+            print(e.toast())
+            return None
+
+    scheduler = Scheduler()
+    policy = PollPolicy(min_interval=10, max_interval=900)
+    for ip in ["192.168.1.235", "192.168.1.236"]:
+        policy.attach(scheduler, ip, lambda ip=ip: poll(ip))
+    scheduler.run()
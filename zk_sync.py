@@ -0,0 +1,134 @@
+import json
+import os
+
+def record_mark(columns, index):
+    # The last-seen record: user_sn (device_user_id on 16-byte UDP records) and
+    # the encoded record time, as stored on the device.
+    key = columns.user_sn[index] if columns.user_sn is not None else columns.device_user_id[index]
+    return [key, columns.record_time[index]]
+
+# Which tables a change in each CMD_GET_FREE_SIZES counter points at.
+TABLE_COUNTERS = {
+    'users': ['userCounts', 'cardCounts'],
+    'attendances': ['logCounts'],
+    'fingers': ['fingerCounts'],
+    'faces': ['faceCounts'],
+}
+
+class ChangeProbe:
+    """
+    Cheap "what changed" check built on CMD_GET_FREE_SIZES alone.
+
+    Keeps the last counters seen per device IP and reports the tables whose
+    counters moved, so bulk reads of unchanged tables can be skipped. Only
+    counts are compared: an edit that leaves every count the same (a renamed
+    user, a log cleared and refilled to the same length) is not detected.
+    """
+    def __init__(self):
+        self.snapshots = {}
+
+    def compare(self, ip, info):
+        # Every table counts as changed on the first probe or when the reply is missing.
+        previous = self.snapshots.get(ip)
+        if info:
+            self.snapshots[ip] = info
+        if not previous or not info:
+            return set(TABLE_COUNTERS)
+        return {table for table, counters in TABLE_COUNTERS.items()
+                if any(previous.get(counter) != info.get(counter) for counter in counters)}
+
+    def probe(self, zk):
+        return self.compare(zk.ip, zk.get_info())
+
+    async def probe_async(self, zk):
+        return self.compare(zk.ip, await zk.get_info())
+
+    def forget(self, ip):
+        self.snapshots.pop(ip, None)
+
+class AttendanceSync:
+    """
+    Incremental attendance sync with a watermark per device IP.
+
+    The watermark holds the device's log count and the last record seen. A
+    poll whose logCounts matches the watermark skips the download; otherwise
+    the log is fetched as columns and only the records past the watermark are
+    decoded. If the record under the watermark no longer matches (the log was
+    cleared or rewritten) the whole log is returned again.
+    """
+    def __init__(self, path='watermarks.json'):
+        self.path = path
+        self.watermarks = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading watermarks from {self.path}: {e}")
+            return {}
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.watermarks, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self, ip=None):
+        if ip is None:
+            self.watermarks = {}
+        else:
+            self.watermarks.pop(ip, None)
+        self.save()
+
+    def unchanged(self, ip, info):
+        watermark = self.watermarks.get(ip)
+        return bool(watermark and info and info.get('logCounts') == watermark['log_count'])
+
+    def advance(self, ip, columns):
+        # Returns the records past the watermark and moves it to the end of the log.
+        watermark = self.watermarks.get(ip)
+        start = 0
+        if watermark and 0 < watermark['log_count'] <= len(columns):
+            if record_mark(columns, watermark['log_count'] - 1) == watermark['mark']:
+                start = watermark['log_count']
+
+        records = list(columns[start:])
+        if len(columns):
+            self.watermarks[ip] = {'log_count': len(columns), 'mark': record_mark(columns, len(columns) - 1)}
+        else:
+            self.watermarks.pop(ip, None)
+        self.save()
+        return {'data': records, 'full': start == 0, 'err': None}
+
+    def sync(self, zk):
+        if self.unchanged(zk.ip, zk.get_info()):
+            return {'data': [], 'full': False, 'err': None}
+        columns = zk.get_attendances(result='columns')['data']
+        return self.advance(zk.ip, columns)
+
+    async def sync_async(self, zk):
+        if self.unchanged(zk.ip, await zk.get_info()):
+            return {'data': [], 'full': False, 'err': None}
+        columns = (await zk.get_attendances(result='columns'))['data']
+        return self.advance(zk.ip, columns)
+
+
+# Example usage
+if __name__ == "__main__":
+    from zk_main import ZKLIB
+    from handler import ZKError
+
+    zk_instance = ZKLIB("192.168.1.235", 4370, 10)
+    watermarks = AttendanceSync()
+    try:
+        zk_instance.create_socket()
+        new_records = watermarks.sync(zk_instance)
+        print("New attendances:", len(new_records['data']), "full resync:", new_records['full'])
+    except ZKError as e:
+        print(e.toast())
+    finally:
+        if zk_instance.connection_type:
+            zk_instance.disconnect()
@@ -1,17 +1,29 @@
+import queue
+import select
 import socket
 import struct
-from time import sleep
-from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK
-from zk_util import create_tcp_header, remove_tcp_header, decode_user_data_72, decode_record_data_40, decode_record_real_time_log_52, decode_tcp_header, check_not_event_tcp
+import threading
+from time import sleep, time as current_time
+from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK, USHRT_MAX, WRITE_CHUNK
+from zk_util import PacketCodec, remove_tcp_header, decode_users_72, decode_records_40, decode_record_data_40, decode_record_real_time_log_52, real_time_log_delay, check_not_event_tcp, decode_free_sizes, encode_users_72
+from zk_records import AttendanceColumns, RecordView, RecordStream, TemplateStream
 
 class JTCP:
-    def __init__(self, ip, port, timeout=10):
+    def __init__(self, ip, port, timeout=10, pipeline_depth=4):
         self.ip = ip
         self.port = port
         self.timeout = timeout
+        self.pipeline_depth = pipeline_depth
         self.session_id = 0
         self.reply_id = 0
+        self.codec = PacketCodec(True)
+        self.send_buffer = bytearray(1024)
         self.socket = None
+        self.recv_buffer = bytearray(8 + 16 + MAX_CHUNK)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.event_queue = None
+        self.event_stats = {'events': 0, 'dropped': 0, 'last_delay': None, 'max_delay': None, 'max_queued': None}
+        self.listening = False
 
     def create_socket(self):
         try:
@@ -39,24 +51,78 @@ class JTCP:
             self.socket.close()
             self.socket = None
 
+    def recv_exactly(self, view, wait=False):
+        # With `wait`, a pause inside a frame is waited out for as long as the
+        # real-time listener runs: giving up mid-frame would lose the framing.
+        received = 0
+        while received < len(view):
+            try:
+                n = self.socket.recv_into(view[received:])
+            except socket.timeout:
+                if wait and self.listening:
+                    continue
+                raise
+            if n == 0:
+                raise ConnectionResetError('ECONNRESET')
+            received += n
+
+    def read_frame_header(self, wait=False):
+        # Prefix plus ZK header of one framed packet; returns the size of the data that follows.
+        self.recv_exactly(self.recv_view[:16], wait)
+        if self.recv_buffer[:4] != b'\x50\x50\x82\x7d':
+            raise Exception('INVALID_TCP_PREFIX')
+        payload_size = struct.unpack_from('<I', self.recv_buffer, 4)[0]
+        if payload_size < 8:
+            raise Exception('INVALID_TCP_PAYLOAD_SIZE')
+        return payload_size - 8
+
+    def read_frame_body(self, size, wait=False):
+        if 16 + size > len(self.recv_buffer):
+            self.recv_buffer = bytearray(16 + size)
+            self.recv_buffer[:16] = self.recv_view[:16]
+            self.recv_view = memoryview(self.recv_buffer)
+        self.recv_exactly(self.recv_view[16:16 + size], wait)
+
+    def read_reply(self, wait=False):
+        # The returned view aliases recv_buffer and is only valid until the next read.
+        size = self.read_frame_header(wait)
+        self.read_frame_body(size, wait)
+        return self.recv_view[:16 + size]
+
+    def read_command_reply(self):
+        while True:
+            reply = self.read_reply()
+            if not check_not_event_tcp(reply):
+                return reply
+
     def write_message(self, msg, connect=False):
         try:
-            self.socket.send(msg)
-            data = self.socket.recv(1024)
-            return data
+            self.socket.sendall(msg)
+            return bytes(self.read_command_reply())
         except socket.timeout:
             print("Timeout on writing message.")
+            # Part of a frame may have been read: resync on the next one.
+            self.drain()
             return None
 
     def request_data(self, msg):
         try:
-            self.socket.send(msg)
-            data = self.socket.recv(1024)
-            return data
+            self.socket.sendall(msg)
+            return self.read_command_reply()
         except socket.timeout:
             print("Timeout on receiving data.")
+            self.drain()
             return None
 
+    def encode_packet(self, command, data=b''):
+        # Encodes into the reusable send buffer; the view is valid until the next send.
+        self.codec.session_id = self.session_id
+        size = self.codec.packet_size(data)
+        if size > len(self.send_buffer):
+            self.send_buffer = bytearray(size)
+        self.codec.encode_into(self.send_buffer, command, self.reply_id, data)
+        return memoryview(self.send_buffer)[:size]
+
     def execute_cmd(self, command, data):
         if command == COMMANDS['CMD_CONNECT']:
             self.session_id = 0
@@ -64,7 +130,7 @@ class JTCP:
         else:
             self.reply_id += 1
 
-        buf = create_tcp_header(command, self.session_id, self.reply_id, data)
+        buf = self.encode_packet(command, data)
         reply = self.write_message(buf, command == COMMANDS['CMD_CONNECT'] or command == COMMANDS['CMD_EXIT'])
 
         if reply:
@@ -78,70 +144,284 @@ class JTCP:
     def send_chunk_request(self, start, size):
         self.reply_id += 1
         req_data = struct.pack('<II', start, size)
-        buf = create_tcp_header(COMMANDS['CMD_DATA_RDY'], self.session_id, self.reply_id, req_data)
-        self.socket.send(buf)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_RDY'], req_data)
+        self.socket.sendall(buf)
+
+    def drain(self, quiet=0.5):
+        self.socket.settimeout(quiet)
+        try:
+            while self.socket.recv_into(self.recv_buffer):
+                pass
+        except socket.timeout:
+            pass
+        finally:
+            self.socket.settimeout(self.timeout)
+
+    def read_chunks(self, view, depth, base=0):
+        # Keeps up to `depth` CMD_DATA_RDY requests in flight. The device answers
+        # each with CMD_PREPARE_DATA, the chunk as CMD_DATA and a closing CMD_ACK_OK
+        # (some firmwares send CMD_DATA only). Replies are matched by reply id, or
+        # in request order when the firmware doesn't echo it, and CMD_DATA bodies
+        # are received straight into the chunk's place in `view`.
+        # `view` holds the download from offset `base` on. Returns how many
+        # leading bytes of `view` were filled.
+        size = len(view)
+        pending = {}
+        next_start = 0
+        # A short chunk ends the download there, but the requests already in
+        # flight are still read off the socket so their replies don't linger.
+        short = size
+        while next_start < short or pending:
+            while next_start < short and len(pending) < depth:
+                chunk_size = min(MAX_CHUNK, size - next_start)
+                self.send_chunk_request(base + next_start, chunk_size)
+                pending[(self.reply_id + 1) % USHRT_MAX] = [next_start, chunk_size, 0, False]
+                next_start += chunk_size
+
+            body_size = self.read_frame_header()
+            command_id, _, _, reply_id = struct.unpack_from('<HHHH', self.recv_buffer, 8)
+            if command_id == COMMANDS['CMD_REG_EVENT']:
+                self.read_frame_body(body_size)
+                continue
+            if reply_id not in pending:
+                reply_id = next(iter(pending))
+            chunk = pending[reply_id]
+            start, chunk_size, received, prepared = chunk
+
+            if command_id == COMMANDS['CMD_DATA']:
+                if received + body_size > chunk_size:
+                    raise Exception('CHUNK_OVERFLOW')
+                offset = start + received
+                self.recv_exactly(view[offset:offset + body_size])
+                chunk[2] = received = received + body_size
+                if not prepared and received >= chunk_size:
+                    del pending[reply_id]
+                continue
+
+            self.read_frame_body(body_size)
+            if command_id == COMMANDS['CMD_PREPARE_DATA']:
+                chunk[3] = True
+            elif command_id == COMMANDS['CMD_ACK_OK']:
+                del pending[reply_id]
+                if received != chunk_size:
+                    short = min(short, start + received)
+            else:
+                raise Exception(f'UNEXPECTED_REPLY_ON_CMD_DATA_RDY: {command_id}')
+        return short
 
     def read_with_buffer(self, req_data, cb=None):
         self.reply_id += 1
-        buf = create_tcp_header(COMMANDS['CMD_DATA_WRRQ'], self.session_id, self.reply_id, req_data)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
         reply = self.request_data(buf)
 
         if reply:
-            header = decode_tcp_header(reply[:16])
-            if header['command_id'] == COMMANDS['CMD_DATA']:
-                return {'data': reply[16:], 'mode': 8}
-            elif header['command_id'] in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            header = self.codec.decode_header(reply)
+            if header.command_id == COMMANDS['CMD_DATA']:
+                return {'data': memoryview(bytes(reply[16:])), 'mode': 8}
+            elif header.command_id in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
                 size = struct.unpack('<I', reply[17:21])[0]
 
-                total_packets = (size + MAX_CHUNK - 1) // MAX_CHUNK
-                reply_data = b''
+                # One allocation for the whole download; chunks land in place.
+                reply_data = memoryview(bytearray(size))
 
-                for i in range(total_packets):
-                    start = i * MAX_CHUNK
-                    chunk_size = min(MAX_CHUNK, size - start)
-                    self.send_chunk_request(start, chunk_size)
-                    chunk_reply = self.request_data(buf)
-                    reply_data += chunk_reply[16:]
+                depth = max(1, self.pipeline_depth)
+                try:
+                    received = self.read_chunks(reply_data, depth)
+                except Exception as err:
+                    if depth == 1 or isinstance(err, ConnectionError):
+                        raise
+                    # The firmware can't queue chunk requests: resync and retry lock-step.
+                    print(f"Pipelined read failed ({err}), falling back to lock-step.")
+                    self.pipeline_depth = 1
+                    self.drain()
+                    self.free_data()
+                    return self.read_with_buffer(req_data, cb)
 
+                if received != size:
+                    return {'data': reply_data[:received], 'err': 'INCOMPLETE_CHUNK'}
                 return {'data': reply_data, 'err': None}
         return None
 
+    def iter_buffer(self, req_data):
+        # Streams the download in order. Each piece is a view into one reused
+        # buffer of pipeline_depth chunks, valid until the next piece is requested.
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = self.request_data(buf)
+        if not reply:
+            return
+
+        header = self.codec.decode_header(reply)
+        if header.command_id == COMMANDS['CMD_DATA']:
+            yield memoryview(bytes(reply[16:]))
+            return
+        if header.command_id not in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            return
+
+        size = struct.unpack('<I', reply[17:21])[0]
+        window = memoryview(bytearray(min(size, max(1, self.pipeline_depth) * MAX_CHUNK)))
+        start = 0
+        while start < size:
+            depth = max(1, self.pipeline_depth)
+            length = min(size - start, depth * MAX_CHUNK)
+            try:
+                received = self.read_chunks(window[:length], depth, start)
+            except Exception as err:
+                if depth == 1 or isinstance(err, ConnectionError):
+                    raise
+                # Chunk requests are addressed by offset, so the window can be re-read lock-step.
+                print(f"Pipelined read failed ({err}), falling back to lock-step.")
+                self.pipeline_depth = 1
+                self.drain()
+                continue
+            yield window[:received]
+            if received != length:
+                raise Exception('INCOMPLETE_CHUNK')
+            start += length
+
+    def iter_attendances(self):
+        # Yields decoded records chunk by chunk while the transfer is running.
+        self.free_data()
+        try:
+            stream = RecordStream(40, decode_records_40)
+            for piece in self.iter_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS']):
+                records = stream.feed(piece)
+                if records:
+                    yield records
+        finally:
+            self.free_data()
+
+    def iter_templates(self):
+        # Yields (uid, fid, valid, template) batches as the transfer runs.
+        self.free_data()
+        try:
+            stream = TemplateStream()
+            for piece in self.iter_buffer(REQUEST_DATA['GET_TEMPLATES']):
+                templates = stream.feed(piece)
+                if templates:
+                    yield templates
+        finally:
+            self.free_data()
+
     def get_users(self):
         self.free_data()
         data = self.read_with_buffer(REQUEST_DATA['GET_USERS'])
         self.free_data()
 
-        users = []
-        user_data = data['data'][4:]  # Skip the first 4 bytes of the data
-
-        while len(user_data) >= 72:
-            try:
-                # Ensure we have exactly 72 bytes for each user record
-                user = decode_user_data_72(user_data[:72])
-                users.append(user)
-            except Exception as e:
-                print(f"Error decoding user data: {e}")
-            finally:
-                # Move to the next user record in the data
-                user_data = user_data[72:]
+        users = decode_users_72(data['data'][4:])
 
         return {'data': users}
 
 
-    def get_attendances(self, cb=None):
+    def get_user_checksum(self):
+        # Has the device prepare the user buffer and checksum it, without transferring it.
+        self.free_data()
+        try:
+            self.reply_id += 1
+            buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], REQUEST_DATA['GET_USERS'])
+            if not self.request_data(buf):
+                return None
+            reply = self.execute_cmd(COMMANDS['CMD_CHECKSUM_BUFFER'], b'')
+            if not reply or len(reply) < 12:
+                return None
+            return struct.unpack('<I', reply[8:12])[0]
+        finally:
+            self.free_data()
+
+    def get_attendances(self, cb=None, result='records'):
+        if cb:
+            # Streaming: cb gets each batch as it is decoded; only the count is kept.
+            count = 0
+            for records in self.iter_attendances():
+                cb(records)
+                count += len(records)
+            return {'data': count}
+
         self.free_data()
         data = self.read_with_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS'], cb)
         self.free_data()
 
-        records = []
-        record_data = data['data'][4:]
-        while len(record_data) >= 40:
-            record = decode_record_data_40(record_data[:40])
-            records.append(record)
-            record_data = record_data[40:]
+        if result == 'columns':
+            records = AttendanceColumns.from_records_40(data['data'][4:])
+        elif result == 'view':
+            records = RecordView(data['data'][4:], 40, decode_record_data_40)
+        else:
+            records = decode_records_40(data['data'][4:])
 
         return {'data': records}
 
+    def write_buffer(self, data):
+        # Stages data in the device buffer: CMD_PREPARE_DATA with its size, then CMD_DATA pieces.
+        reply = self.execute_cmd(COMMANDS['CMD_PREPARE_DATA'], struct.pack('<I', len(data)))
+        if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+            raise Exception('PREPARE_DATA_REFUSED')
+        view = memoryview(data)
+        for start in range(0, len(data), WRITE_CHUNK):
+            reply = self.execute_cmd(COMMANDS['CMD_DATA'], view[start:start + WRITE_CHUNK])
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                raise Exception('DATA_REFUSED')
+
+    def set_users(self, users, refresh=True):
+        # One buffered transfer for the whole list; firmware that rejects the
+        # buffered CMD_USER_WRQ gets one CMD_USER_WRQ per record instead.
+        buf = encode_users_72(users)
+        self.free_data()
+        try:
+            self.write_buffer(buf)
+            reply = self.execute_cmd(COMMANDS['CMD_USER_WRQ'], b'')
+            failed = []
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                view = memoryview(buf)
+                for index, user in enumerate(users):
+                    reply = self.execute_cmd(COMMANDS['CMD_USER_WRQ'], view[index * 72:(index + 1) * 72])
+                    if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                        failed.append(user['uid'])
+            if refresh:
+                self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            self.free_data()
+
+        if failed:
+            return {'data': len(users) - len(failed), 'failed': failed, 'err': 'USER_WRQ_FAILED'}
+        return {'data': len(users), 'err': None}
+
+    def set_templates(self, templates, refresh=True):
+        # Each (uid, fid, valid, template) is staged with write_buffer and stored
+        # with CMD_TMP_WRITE; the device is refreshed once at the end.
+        failed = []
+        try:
+            for uid, fid, valid, template in templates:
+                try:
+                    self.write_buffer(template)
+                except Exception:
+                    failed.append((uid, fid))
+                    continue
+                reply = self.execute_cmd(COMMANDS['CMD_TMP_WRITE'], struct.pack('<HbbH', uid, fid, valid, len(template)))
+                if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                    failed.append((uid, fid))
+                self.free_data()
+            if refresh:
+                self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            self.free_data()
+
+        if failed:
+            return {'data': len(templates) - len(failed), 'failed': failed, 'err': 'TMP_WRITE_FAILED'}
+        return {'data': len(templates), 'err': None}
+
+    def delete_users(self, uids, refresh=True):
+        failed = []
+        for uid in uids:
+            reply = self.execute_cmd(COMMANDS['CMD_DELETE_USER'], struct.pack('<H', uid))
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                failed.append(uid)
+        if refresh:
+            self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+
+        if failed:
+            return {'data': len(uids) - len(failed), 'failed': failed, 'err': 'DELETE_USER_FAILED'}
+        return {'data': len(uids), 'err': None}
+
     def free_data(self):
         self.execute_cmd(COMMANDS['CMD_FREE_DATA'], b'')
 
@@ -155,12 +435,90 @@ class JTCP:
         self.execute_cmd(COMMANDS['CMD_EXIT'], b'')
         self.close_socket()
 
+    def ack_event(self):
+        # The firmware expects CMD_ACK_OK for every event, sent with reply id USHRT_MAX - 1.
+        self.codec.session_id = self.session_id
+        self.socket.sendall(self.codec.encode(COMMANDS['CMD_ACK_OK'], USHRT_MAX - 1))
+
+    def queue_event(self, record):
+        # Bounded: when the consumer falls behind, the oldest event is dropped.
+        while True:
+            try:
+                self.event_queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.event_queue.get_nowait()
+                    self.event_stats['dropped'] += 1
+                except queue.Empty:
+                    pass
+
+    def hand_off(self, record):
+        # Stamps the record as it reaches the consumer: `delay` runs from the
+        # device's timestamp, `queued` is the time spent on event_queue.
+        now = current_time()
+        record['queued'] = now - record['received']
+        record['delay'] = real_time_log_delay(record['att_time'], now)
+        stats = self.event_stats
+        stats['last_delay'] = record['delay']
+        stats['max_delay'] = max(record['delay'], stats['max_delay'] or record['delay'])
+        stats['max_queued'] = max(record['queued'], stats['max_queued'] or 0)
+
+    def dispatch_events(self, cb):
+        while True:
+            record = self.event_queue.get()
+            if record is None:
+                return
+            self.hand_off(record)
+            try:
+                cb(record)
+            except Exception as e:
+                print("Error in real-time callback:", e)
+
+    def get_real_time_logs(self, cb=None, max_queue=1000):
+        # Blocks until stop_real_time_logs(), which is noticed within `timeout` seconds.
+        # Events go on event_queue; with cb, a separate thread drains the queue so
+        # a slow cb never delays the ACKs. Without cb the caller reads event_queue
+        # itself, and delays are measured when the event is queued.
+        self.event_queue = queue.Queue(max_queue)
+        self.execute_cmd(COMMANDS['CMD_REG_EVENT'], REQUEST_DATA['GET_REAL_TIME_EVENT'])
+        dispatcher = None
+        if cb:
+            dispatcher = threading.Thread(target=self.dispatch_events, args=(cb,), daemon=True)
+            dispatcher.start()
+
+        self.listening = True
+        try:
+            while self.listening:
+                # Only the wait for a new frame is bounded by `timeout`.
+                if not select.select([self.socket], [], [], self.timeout)[0]:
+                    continue
+                try:
+                    reply = self.read_reply(True)
+                except socket.timeout:
+                    continue
+                if not check_not_event_tcp(reply):
+                    continue
+                self.ack_event()
+                if len(reply) < 52:
+                    continue
+                record = decode_record_real_time_log_52(bytes(reply))
+                record['received'] = current_time()
+                self.event_stats['events'] += 1
+                if not dispatcher:
+                    self.hand_off(record)
+                self.queue_event(record)
+        finally:
+            self.listening = False
+            if dispatcher:
+                self.queue_event(None)
+                dispatcher.join(self.timeout)
+
+    def stop_real_time_logs(self):
+        self.listening = False
+
     def get_info(self):
         data = self.execute_cmd(COMMANDS['CMD_GET_FREE_SIZES'], b'')
-        return {
-            'userCounts': struct.unpack('<I', data[24:28])[0],
-            'logCounts': struct.unpack('<I', data[40:44])[0],
-            'logCapacity': struct.unpack('<I', data[72:76])[0]
-        }
+        return decode_free_sizes(data)
 
     # Additional methods like getSerialNumber, getDeviceVersion, etc., follow a similar pattern
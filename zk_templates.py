@@ -0,0 +1,177 @@
+import os
+import struct
+from zk_records import TEMPLATE_HEADER
+from zk_fleet import ZKFleet
+
+INDEX_ENTRY = struct.Struct('<HbbQI')
+
+class TemplateStore:
+    """
+    Fingerprint templates kept on disk as size-prefixed blobs.
+
+    `path` holds the records back to back in the device's own layout (size,
+    uid, finger index, valid flag, template); `path + '.idx'` maps each
+    (uid, fid) to the offset and size of its latest record. Only the index
+    lives in memory, so a download is written straight through however
+    many templates it holds. Replaced records stay in the data file until
+    compact().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.index = self.load_index()
+        self.file = open(path, 'ab+')
+
+    def load_index(self):
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                for uid, fid, valid, offset, size in INDEX_ENTRY.iter_unpack(f.read()):
+                    index[(uid, fid)] = (valid, offset, size)
+        return index
+
+    def save_index(self):
+        buf = bytearray(INDEX_ENTRY.size * len(self.index))
+        for position, ((uid, fid), (valid, offset, size)) in enumerate(sorted(self.index.items())):
+            INDEX_ENTRY.pack_into(buf, position * INDEX_ENTRY.size, uid, fid, valid, offset, size)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp_path, self.index_path)
+
+    def put(self, uid, fid, valid, template):
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        size = TEMPLATE_HEADER.size + len(template)
+        self.file.write(TEMPLATE_HEADER.pack(size, uid, fid, valid))
+        self.file.write(template)
+        self.index[(uid, fid)] = (valid, offset, size)
+
+    def put_many(self, templates):
+        for uid, fid, valid, template in templates:
+            self.put(uid, fid, valid, template)
+
+    def get(self, uid, fid):
+        entry = self.index.get((uid, fid))
+        if entry is None:
+            return None
+        valid, offset, size = entry
+        self.file.seek(offset + TEMPLATE_HEADER.size)
+        return self.file.read(size - TEMPLATE_HEADER.size)
+
+    def fingers(self, uid):
+        return sorted(fid for key_uid, fid in self.index if key_uid == uid)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        # In file order, one record at a time.
+        for (uid, fid), (valid, offset, size) in sorted(self.index.items(), key=lambda item: item[1][1]):
+            self.file.seek(offset + TEMPLATE_HEADER.size)
+            yield uid, fid, valid, self.file.read(size - TEMPLATE_HEADER.size)
+
+    def flush(self):
+        self.file.flush()
+        self.save_index()
+
+    def compact(self):
+        # Rewrites the data file with only the records the index points at.
+        tmp_path = self.path + '.tmp'
+        index = {}
+        with open(tmp_path, 'wb') as out:
+            for uid, fid, valid, template in self:
+                index[(uid, fid)] = (valid, out.tell(), TEMPLATE_HEADER.size + len(template))
+                out.write(TEMPLATE_HEADER.pack(TEMPLATE_HEADER.size + len(template), uid, fid, valid))
+                out.write(template)
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.index = index
+        self.file = open(self.path, 'ab+')
+        self.save_index()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def download_templates(zk, store):
+    # Streams every template on the device into the store; returns how many.
+    count = 0
+    for templates in zk.iter_templates():
+        store.put_many(templates)
+        count += len(templates)
+    store.flush()
+    return {'data': count, 'err': None}
+
+async def download_templates_async(zk, store):
+    count = 0
+    async for templates in zk.iter_templates():
+        store.put_many(templates)
+        count += len(templates)
+    store.flush()
+    return {'data': count, 'err': None}
+
+
+def collect_templates(zk, uids):
+    # One streamed download from the source, keeping only the given users' templates.
+    uids = set(uids)
+    return [template for templates in zk.iter_templates() for template in templates if template[0] in uids]
+
+def replicate_templates(templates, targets, concurrency=8, deadline=60, retries=2, backend='asyncio'):
+    """
+    Uploads the same templates to every target device in parallel.
+
+    `templates` are (uid, fid, valid, template) tuples, e.g. from
+    collect_templates() or a TemplateStore. Each target gets them through
+    set_templates() on a ZKFleet, so at most `concurrency` devices are
+    written at once and each has its own deadline; devices that fail or
+    report rejected templates are retried up to `retries` more times.
+    Returns {'data': {ip: templates written}, 'failed': {ip: [(uid, fid)]},
+    'err': {ip: error}, 'attempts': {ip: runs}}; a device that still has an
+    error keeps the count and rejected templates of its last write.
+    """
+    fleet = targets if isinstance(targets, ZKFleet) else ZKFleet(targets, concurrency, deadline, backend)
+    report = {'data': {}, 'failed': {}, 'err': {}, 'attempts': {}}
+    pending = list(fleet.states)
+    for _ in range(retries + 1):
+        if not pending:
+            break
+        result = fleet.run('set_templates', templates, ips=pending)
+        pending = []
+        for ip in result['data']:
+            report['attempts'][ip] = report['attempts'].get(ip, 0) + 1
+            written = result['data'][ip]
+            report['data'][ip] = written['data']
+            if written['err']:
+                report['failed'][ip] = written['failed']
+                report['err'][ip] = written['err']
+                pending.append(ip)
+            else:
+                report['failed'].pop(ip, None)
+                report['err'].pop(ip, None)
+        for ip, err in result['err'].items():
+            report['attempts'][ip] = report['attempts'].get(ip, 0) + 1
+            report['err'][ip] = err
+            pending.append(ip)
+    return report
+
+
+# Example usage: copy one user's fingers from the enrolment clock to the others
+if __name__ == "__main__":
+    from zk_main import ZKLIB
+    from handler import ZKError
+
+    zk_instance = ZKLIB("192.168.1.235", 4370, 10)
+    try:
+        zk_instance.create_socket()
+        templates = collect_templates(zk_instance, [1])
+        zk_instance.disconnect()
+        report = replicate_templates(templates, ["192.168.1.236", "192.168.1.237"])
+        print("Written:", report['data'])
+        for ip, err in report['err'].items():
+            print(ip, err.toast() if isinstance(err, ZKError) else err, report['data'].get(ip), report['failed'].get(ip))
+    except ZKError as e:
+        print(e.toast())
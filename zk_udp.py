@@ -1,18 +1,27 @@
 import socket
 import struct
-from time import sleep
-from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK
-from zk_util import create_udp_header, decode_user_data_28, decode_record_data_16, decode_record_real_time_log_18, decode_udp_header, check_not_event_udp
+from collections import deque
+from time import sleep, monotonic
+from zk_commands import COMMANDS, REQUEST_DATA, MAX_CHUNK, USHRT_MAX, UDP_SEGMENT, WRITE_CHUNK
+from zk_util import PacketCodec, decode_users_28, decode_records_16, decode_record_data_16, decode_record_real_time_log_18, check_not_event_udp, decode_free_sizes, encode_users_28
+from zk_records import AttendanceColumns, RecordView, RecordStream, TemplateStream
 
 class JUDP:
-    def __init__(self, ip, port, timeout=10, inport=0):
+    def __init__(self, ip, port, timeout=10, inport=0, window=16):
         self.ip = ip
         self.port = port
         self.timeout = timeout
         self.inport = inport
+        self.window = window
+        self.segment_timeout = 1.0
+        self.max_retries = 5
         self.socket = None
         self.session_id = 0
         self.reply_id = 0
+        self.codec = PacketCodec(False)
+        self.send_buffer = bytearray(1024)
+        self.recv_buffer = bytearray(65536)
+        self.recv_view = memoryview(self.recv_buffer)
 
     def create_socket(self):
         try:
@@ -60,6 +69,15 @@ class JUDP:
             print("Timeout on receiving data.")
             return None
 
+    def encode_packet(self, command, data=b''):
+        # Encodes into the reusable send buffer; the view is valid until the next send.
+        self.codec.session_id = self.session_id
+        size = self.codec.packet_size(data)
+        if size > len(self.send_buffer):
+            self.send_buffer = bytearray(size)
+        self.codec.encode_into(self.send_buffer, command, self.reply_id, data)
+        return memoryview(self.send_buffer)[:size]
+
     def execute_cmd(self, command, data):
         if command == COMMANDS['CMD_CONNECT']:
             self.session_id = 0
@@ -67,7 +85,7 @@ class JUDP:
         else:
             self.reply_id += 1
 
-        buf = create_udp_header(command, self.session_id, self.reply_id, data)
+        buf = self.encode_packet(command, data)
         reply = self.write_message(buf)
 
         if reply and len(reply) > 0:
@@ -79,58 +97,288 @@ class JUDP:
     def send_chunk_request(self, start, size):
         self.reply_id += 1
         req_data = struct.pack('<II', start, size)
-        buf = create_udp_header(COMMANDS['CMD_DATA_RDY'], self.session_id, self.reply_id, req_data)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_RDY'], req_data)
         self.socket.sendto(buf, (self.ip, self.port))
 
+    def drain(self, quiet=0):
+        # Discards datagrams until none arrives for `quiet` seconds; with 0, only
+        # those already queued.
+        self.socket.settimeout(quiet)
+        try:
+            while True:
+                self.socket.recv_into(self.recv_buffer)
+        except (socket.timeout, BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.socket.settimeout(self.timeout)
+
+    def read_window(self, view, base=0):
+        # Sliding-window download for lossy links. The buffer is requested in
+        # UDP_SEGMENT pieces so each CMD_DATA_RDY is answered by a single CMD_DATA
+        # datagram, placed by the reply id it echoes. A segment that times out or
+        # is refused is re-requested alone, from the first byte still missing.
+        # A complete segment waits in `acks` for the device's closing CMD_ACK_OK
+        # (at most segment_timeout), so no reply outlives the download.
+        # `view` holds the download from offset `base` on. Returns how many
+        # leading bytes of `view` were filled.
+        size = len(view)
+        queue = deque((start, min(UDP_SEGMENT, size - start)) for start in range(0, size, UDP_SEGMENT))
+        pending = {}
+        acks = {}
+        acked = set()
+        issued = set()
+        retries = {}
+
+        while queue or pending or acks:
+            while queue and len(pending) < max(1, self.window):
+                start, length = queue.popleft()
+                self.send_chunk_request(base + start, length)
+                reply_id = (self.reply_id + 1) % USHRT_MAX
+                issued.add(reply_id)
+                pending[reply_id] = [start, length, 0, monotonic() + self.segment_timeout]
+
+            expires = min([segment[3] for segment in pending.values()] + list(acks.values()))
+            self.socket.settimeout(max(expires - monotonic(), 0.001))
+            try:
+                n, _ = self.socket.recvfrom_into(self.recv_buffer)
+            except socket.timeout:
+                n = 0
+
+            failed = []
+            if n >= 8:
+                command_id, _, _, reply_id = struct.unpack_from('<HHHH', self.recv_buffer, 0)
+                if reply_id not in issued and command_id != COMMANDS['CMD_REG_EVENT']:
+                    # The firmware doesn't echo reply ids, so only lock-step can place data.
+                    self.window = 1
+                    if command_id == COMMANDS['CMD_ACK_OK'] and acks:
+                        reply_id = next(iter(acks))
+                    elif len(pending) == 1:
+                        reply_id = next(iter(pending))
+                segment = pending.get(reply_id)
+                if segment and command_id == COMMANDS['CMD_DATA']:
+                    start, length, received, _ = segment
+                    body = min(n - 8, length - received)
+                    view[start + received:start + received + body] = self.recv_view[8:8 + body]
+                    segment[2] = received + body
+                    if segment[2] >= length:
+                        del pending[reply_id]
+                        if reply_id in acked:
+                            acked.discard(reply_id)
+                        else:
+                            acks[reply_id] = monotonic() + self.segment_timeout
+                elif command_id == COMMANDS['CMD_ACK_OK']:
+                    # May overtake the data it closes.
+                    if acks.pop(reply_id, None) is None and reply_id in issued:
+                        acked.add(reply_id)
+                elif segment and command_id not in [COMMANDS['CMD_PREPARE_DATA'], COMMANDS['CMD_ACK_OK']]:
+                    failed.append(reply_id)
+
+            now = monotonic()
+            for reply_id in [reply_id for reply_id, expires in acks.items() if expires <= now]:
+                del acks[reply_id]
+            # A refused segment may have expired as well: retry it once.
+            failed += [reply_id for reply_id, segment in pending.items() if segment[3] <= now and reply_id not in failed]
+            for reply_id in failed:
+                start, length, received, _ = pending.pop(reply_id)
+                start, length = start + received, length - received
+                retries[start] = retries.get(start, 0) + 1
+                if retries[start] > self.max_retries:
+                    # Requests still in flight may answer late: wait them out.
+                    self.drain(self.segment_timeout)
+                    return min([start] + [s[0] + s[2] for s in pending.values()] + [q[0] for q in queue])
+                queue.appendleft((start, length))
+
+        self.drain()
+        return size
+
     def read_with_buffer(self, req_data, cb=None):
         self.reply_id += 1
-        buf = create_udp_header(COMMANDS['CMD_DATA_WRRQ'], self.session_id, self.reply_id, req_data)
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
         reply = self.request_data(buf)
 
         if reply:
-            header = decode_udp_header(reply[:8])
-            if header['command_id'] == COMMANDS['CMD_DATA']:
-                return {'data': reply[8:], 'mode': 8}
-            elif header['command_id'] in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            header = self.codec.decode_header(reply)
+            if header.command_id == COMMANDS['CMD_DATA']:
+                return {'data': memoryview(reply)[8:], 'mode': 8}
+            elif header.command_id in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
                 size = struct.unpack('<I', reply[9:13])[0]
-                total_buffer = b''
 
-                for i in range(0, size, MAX_CHUNK):
-                    self.send_chunk_request(i, min(MAX_CHUNK, size - i))
-                    chunk_reply = self.request_data(buf)
-                    total_buffer += chunk_reply[8:]
+                # One allocation for the whole download; segments land in place.
+                total_buffer = memoryview(bytearray(size))
+                received = self.read_window(total_buffer)
 
+                if received != size:
+                    return {'data': total_buffer[:received], 'err': 'INCOMPLETE_CHUNK'}
                 return {'data': total_buffer, 'err': None}
         return None
 
+    def iter_buffer(self, req_data):
+        # Streams the download in order, one MAX_CHUNK piece at a time. Each piece
+        # is a view into one reused buffer, valid until the next piece is requested.
+        self.reply_id += 1
+        buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], req_data)
+        reply = self.request_data(buf)
+        if not reply:
+            return
+
+        header = self.codec.decode_header(reply)
+        if header.command_id == COMMANDS['CMD_DATA']:
+            yield memoryview(reply)[8:]
+            return
+        if header.command_id not in [COMMANDS['CMD_ACK_OK'], COMMANDS['CMD_PREPARE_DATA']]:
+            return
+
+        size = struct.unpack('<I', reply[9:13])[0]
+        window = memoryview(bytearray(min(size, MAX_CHUNK)))
+        for start in range(0, size, MAX_CHUNK):
+            length = min(MAX_CHUNK, size - start)
+            received = self.read_window(window[:length], start)
+            yield window[:received]
+            if received != length:
+                raise Exception('INCOMPLETE_CHUNK')
+
+    def iter_attendances(self):
+        # Yields decoded records chunk by chunk while the transfer is running.
+        self.free_data()
+        try:
+            stream = RecordStream(16, decode_records_16)
+            for piece in self.iter_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS']):
+                records = stream.feed(piece)
+                if records:
+                    yield records
+        finally:
+            self.free_data()
+
+    def iter_templates(self):
+        # Yields (uid, fid, valid, template) batches as the transfer runs.
+        self.free_data()
+        try:
+            stream = TemplateStream()
+            for piece in self.iter_buffer(REQUEST_DATA['GET_TEMPLATES']):
+                templates = stream.feed(piece)
+                if templates:
+                    yield templates
+        finally:
+            self.free_data()
+
     def get_users(self):
         self.free_data()
         data = self.read_with_buffer(REQUEST_DATA['GET_USERS'])
         self.free_data()
 
-        users = []
-        user_data = data['data'][4:]
-        while len(user_data) >= 28:
-            user = decode_user_data_28(user_data[:28])
-            users.append(user)
-            user_data = user_data[28:]
+        users = decode_users_28(data['data'][4:])
 
         return {'data': users}
 
-    def get_attendances(self, cb=None):
+    def get_user_checksum(self):
+        # Has the device prepare the user buffer and checksum it, without transferring it.
+        self.free_data()
+        try:
+            self.reply_id += 1
+            buf = self.encode_packet(COMMANDS['CMD_DATA_WRRQ'], REQUEST_DATA['GET_USERS'])
+            if not self.request_data(buf):
+                return None
+            reply = self.execute_cmd(COMMANDS['CMD_CHECKSUM_BUFFER'], b'')
+            if not reply or len(reply) < 12:
+                return None
+            return struct.unpack('<I', reply[8:12])[0]
+        finally:
+            self.free_data()
+
+    def get_attendances(self, cb=None, result='records'):
+        if cb:
+            # Streaming: cb gets each batch as it is decoded; only the count is kept.
+            count = 0
+            for records in self.iter_attendances():
+                cb(records)
+                count += len(records)
+            return {'data': count}
+
         self.free_data()
         data = self.read_with_buffer(REQUEST_DATA['GET_ATTENDANCE_LOGS'], cb)
         self.free_data()
 
-        records = []
-        record_data = data['data'][4:]
-        while len(record_data) >= 16:
-            record = decode_record_data_16(record_data[:16])
-            records.append(record)
-            record_data = record_data[16:]
+        if result == 'columns':
+            records = AttendanceColumns.from_records_16(data['data'][4:])
+        elif result == 'view':
+            records = RecordView(data['data'][4:], 16, decode_record_data_16)
+        else:
+            records = decode_records_16(data['data'][4:])
 
         return {'data': records}
 
+    def write_buffer(self, data):
+        # Stages data in the device buffer: CMD_PREPARE_DATA with its size, then CMD_DATA pieces.
+        reply = self.execute_cmd(COMMANDS['CMD_PREPARE_DATA'], struct.pack('<I', len(data)))
+        if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+            raise Exception('PREPARE_DATA_REFUSED')
+        view = memoryview(data)
+        for start in range(0, len(data), WRITE_CHUNK):
+            reply = self.execute_cmd(COMMANDS['CMD_DATA'], view[start:start + WRITE_CHUNK])
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                raise Exception('DATA_REFUSED')
+
+    def set_users(self, users, refresh=True):
+        # One buffered transfer for the whole list; firmware that rejects the
+        # buffered CMD_USER_WRQ gets one CMD_USER_WRQ per record instead.
+        buf = encode_users_28(users)
+        self.free_data()
+        try:
+            self.write_buffer(buf)
+            reply = self.execute_cmd(COMMANDS['CMD_USER_WRQ'], b'')
+            failed = []
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                view = memoryview(buf)
+                for index, user in enumerate(users):
+                    reply = self.execute_cmd(COMMANDS['CMD_USER_WRQ'], view[index * 28:(index + 1) * 28])
+                    if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                        failed.append(user['uid'])
+            if refresh:
+                self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            self.free_data()
+
+        if failed:
+            return {'data': len(users) - len(failed), 'failed': failed, 'err': 'USER_WRQ_FAILED'}
+        return {'data': len(users), 'err': None}
+
+    def set_templates(self, templates, refresh=True):
+        # Each (uid, fid, valid, template) is staged with write_buffer and stored
+        # with CMD_TMP_WRITE; the device is refreshed once at the end.
+        failed = []
+        try:
+            for uid, fid, valid, template in templates:
+                try:
+                    self.write_buffer(template)
+                except Exception:
+                    failed.append((uid, fid))
+                    continue
+                reply = self.execute_cmd(COMMANDS['CMD_TMP_WRITE'], struct.pack('<HbbH', uid, fid, valid, len(template)))
+                if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                    failed.append((uid, fid))
+                self.free_data()
+            if refresh:
+                self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+        finally:
+            self.free_data()
+
+        if failed:
+            return {'data': len(templates) - len(failed), 'failed': failed, 'err': 'TMP_WRITE_FAILED'}
+        return {'data': len(templates), 'err': None}
+
+    def delete_users(self, uids, refresh=True):
+        failed = []
+        for uid in uids:
+            reply = self.execute_cmd(COMMANDS['CMD_DELETE_USER'], struct.pack('<H', uid))
+            if not reply or struct.unpack('<H', reply[0:2])[0] != COMMANDS['CMD_ACK_OK']:
+                failed.append(uid)
+        if refresh:
+            self.execute_cmd(COMMANDS['CMD_REFRESHDATA'], b'')
+
+        if failed:
+            return {'data': len(uids) - len(failed), 'failed': failed, 'err': 'DELETE_USER_FAILED'}
+        return {'data': len(uids), 'err': None}
+
     def free_data(self):
         self.execute_cmd(COMMANDS['CMD_FREE_DATA'], b'')
 
@@ -157,7 +405,7 @@ class JUDP:
 
     def get_real_time_logs(self, cb=None):
         self.reply_id += 1
-        buf = create_udp_header(COMMANDS['CMD_REG_EVENT'], self.session_id, self.reply_id, REQUEST_DATA['GET_REAL_TIME_EVENT'])
+        buf = self.encode_packet(COMMANDS['CMD_REG_EVENT'], REQUEST_DATA['GET_REAL_TIME_EVENT'])
         self.socket.sendto(buf, (self.ip, self.port))
 
         while True:
@@ -171,11 +419,7 @@ class JUDP:
         try:
             data = self.execute_cmd(COMMANDS['CMD_GET_FREE_SIZES'], b'')
             if data:
-                return {
-                    'userCounts': struct.unpack('<I', data[24:28])[0],
-                    'logCounts': struct.unpack('<I', data[40:44])[0],
-                    'logCapacity': struct.unpack('<I', data[72:76])[0]
-                }
+                return decode_free_sizes(data)
         except Exception as err:
             print(f"Error getting info: {err}")
             return None
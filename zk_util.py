@@ -1,22 +1,9 @@
 import struct
+from time import mktime, time as current_time
 from zk_commands import COMMANDS, USHRT_MAX
+from time1 import unpack as parse_time_to_date
 from log import log
 
-def parse_time_to_date(time):
-    second = time % 60
-    time = (time - second) // 60
-    minute = time % 60
-    time = (time - minute) // 60
-    hour = time % 24
-    time = (time - hour) // 24
-    day = time % 31 + 1
-    time = (time - (day - 1)) // 31
-    month = time % 12
-    time = (time - month) // 12
-    year = time + 2000
-    
-    return (year, month + 1, day, hour, minute, second)
-
 def parse_hex_to_time(hex_data):
     time = {
         'year': hex_data[0],
@@ -29,58 +16,76 @@ def parse_hex_to_time(hex_data):
     
     return (2000 + time['year'], time['month'] - 1, time['date'], time['hour'], time['minute'], time['second'])
 
+def sum_checksum_words(buf, chksum=0):
+    # Adds buf, as little-endian 16-bit words plus an odd trailing byte, to a
+    # running sum kept modulo USHRT_MAX. Since 0x10000 % USHRT_MAX == 1, that sum
+    # is the whole buffer read as one little-endian integer, modulo USHRT_MAX.
+    # Pieces summed separately must split on even offsets.
+    return (chksum + int.from_bytes(buf, 'little')) % USHRT_MAX
+
 def create_checksum(buf):
-    chksum = 0
-    for i in range(0, len(buf), 2):
-        if i == len(buf) - 1:
-            chksum += buf[i]
+    return USHRT_MAX - sum_checksum_words(buf) - 1
+
+def update_checksum(chksum, old_word, new_word):
+    # Checksum after one 16-bit word at an even offset changed from old_word to
+    # new_word, without rescanning the rest of the packet.
+    return USHRT_MAX - 1 - (USHRT_MAX - 1 - chksum - old_word + new_word) % USHRT_MAX
+
+TCP_MAGIC = b'\x50\x50\x82\x7d'
+UDP_HEADER = struct.Struct('<HHHH')
+TCP_HEADER = struct.Struct('<4sIHHHH')
+
+class PacketHeader:
+    __slots__ = ('command_id', 'checksum', 'session_id', 'reply_id', 'payload_size')
+
+class PacketCodec:
+    """
+    Packet framing for one session.
+
+    Holds the precompiled header struct and the session id, encodes packets
+    into a caller-provided buffer and decodes reply headers into one reused
+    PacketHeader, so no per-command dicts or intermediate buffers are built.
+    """
+    def __init__(self, tcp=True, session_id=0):
+        self.tcp = tcp
+        self.header_size = 16 if tcp else 8
+        self.session_id = session_id
+        self.header = PacketHeader()
+
+    def packet_size(self, data=b''):
+        return self.header_size + len(data)
+
+    def encode_into(self, buf, command, reply_id, data=b''):
+        # The checksum covers the header with the un-incremented reply id, as
+        # create_udp_header always did; the packet then carries reply_id + 1.
+        size = self.header_size + len(data)
+        buf[self.header_size:size] = data
+        chksum = USHRT_MAX - 1 - sum_checksum_words(data, command + self.session_id + reply_id)
+        if self.tcp:
+            TCP_HEADER.pack_into(buf, 0, TCP_MAGIC, size - 8, command, chksum, self.session_id, (reply_id + 1) % USHRT_MAX)
         else:
-            chksum += struct.unpack('<H', buf[i:i+2])[0]
-        chksum %= USHRT_MAX
-    chksum = USHRT_MAX - chksum - 1
-  
-    return chksum
+            UDP_HEADER.pack_into(buf, 0, command, chksum, self.session_id, (reply_id + 1) % USHRT_MAX)
+        return size
+
+    def encode(self, command, reply_id, data=b''):
+        buf = bytearray(self.header_size + len(data))
+        self.encode_into(buf, command, reply_id, data)
+        return buf
+
+    def decode_header(self, buf):
+        header = self.header
+        if self.tcp:
+            _, header.payload_size, header.command_id, header.checksum, header.session_id, header.reply_id = TCP_HEADER.unpack_from(buf)
+        else:
+            header.command_id, header.checksum, header.session_id, header.reply_id = UDP_HEADER.unpack_from(buf)
+            header.payload_size = len(buf) - 8
+        return header
 
 def create_udp_header(command, session_id, reply_id, data=b''):
-    data_buffer = data
-    buf = bytearray(8 + len(data_buffer))
-    
-    struct.pack_into('<H', buf, 0, command)
-    struct.pack_into('<H', buf, 2, 0)  # Placeholder for checksum
-    struct.pack_into('<H', buf, 4, session_id)
-    struct.pack_into('<H', buf, 6, reply_id)
-    
-    buf[8:] = data_buffer
-    
-    checksum = create_checksum(buf)
-    struct.pack_into('<H', buf, 2, checksum)
-    
-    reply_id = (reply_id + 1) % USHRT_MAX
-    struct.pack_into('<H', buf, 6, reply_id)
-    
-    return buf
+    return PacketCodec(False, session_id).encode(command, reply_id, data)
 
 def create_tcp_header(command, session_id, reply_id, data=b''):
-    data_buffer = data
-    buf = bytearray(8 + len(data_buffer))
-    
-    struct.pack_into('<H', buf, 0, command)
-    struct.pack_into('<H', buf, 2, 0)  # Placeholder for checksum
-    struct.pack_into('<H', buf, 4, session_id)
-    struct.pack_into('<H', buf, 6, reply_id)
-    
-    buf[8:] = data_buffer
-    
-    checksum = create_checksum(buf)
-    struct.pack_into('<H', buf, 2, checksum)
-    
-    reply_id = (reply_id + 1) % USHRT_MAX
-    struct.pack_into('<H', buf, 6, reply_id)
-    
-    prefix_buf = bytearray([0x50, 0x50, 0x82, 0x7d, 0x13, 0x00, 0x00, 0x00])
-    struct.pack_into('<H', prefix_buf, 4, len(buf))
-    
-    return prefix_buf + buf
+    return PacketCodec(True, session_id).encode(command, reply_id, data)
 
 def remove_tcp_header(buf):
     if len(buf) < 8:
@@ -94,7 +99,7 @@ def remove_tcp_header(buf):
 def decode_user_data_28(user_data):
     uid = struct.unpack('<H', user_data[0:2])[0]
     role = struct.unpack('<B', user_data[2:3])[0]
-    name = user_data[8:16].decode('ascii').split('\0')[0]
+    name = bytes(user_data[8:16]).decode('ascii').split('\0')[0]
     user_id = struct.unpack('<L', user_data[24:28])[0]
     return {'uid': uid, 'role': role, 'name': name, 'user_id': user_id}
 
@@ -106,10 +111,10 @@ def decode_user_data_72(user_data):
     try:
         uid = struct.unpack('<H', user_data[0:2])[0]
         role = struct.unpack('<B', user_data[2:3])[0]
-        password = user_data[3:11].decode('ascii', errors='ignore').split('\0')[0]
-        name = user_data[11:].decode('ascii', errors='ignore').split('\0')[0]
+        password = bytes(user_data[3:11]).decode('ascii', errors='ignore').split('\0')[0]
+        name = bytes(user_data[11:]).decode('ascii', errors='ignore').split('\0')[0]
         cardno = struct.unpack('<I', user_data[35:39])[0]
-        user_id = user_data[48:57].decode('ascii', errors='ignore').split('\0')[0]
+        user_id = bytes(user_data[48:57]).decode('ascii', errors='ignore').split('\0')[0]
 
         return {
             'uid': uid,
@@ -126,7 +131,7 @@ def decode_user_data_72(user_data):
 
 def decode_record_data_40(record_data):
     user_sn = struct.unpack('<H', record_data[0:2])[0]
-    device_user_id = record_data[2:11].decode('ascii').split('\0')[0]
+    device_user_id = bytes(record_data[2:11]).decode('ascii').split('\0')[0]
     record_time = parse_time_to_date(struct.unpack('<L', record_data[27:31])[0])
     return {'user_sn': user_sn, 'device_user_id': device_user_id, 'record_time': record_time}
 
@@ -135,6 +140,89 @@ def decode_record_data_16(record_data):
     record_time = parse_time_to_date(struct.unpack('<L', record_data[4:8])[0])
     return {'device_user_id': device_user_id, 'record_time': record_time}
 
+USER_28 = struct.Struct('<HB5x8s8xL')
+USER_72 = struct.Struct('<HB8s61s')
+USER_72_TAIL = struct.Struct('<35xI9x9s15x')
+RECORD_40 = struct.Struct('<H9s16xL9x')
+RECORD_16 = struct.Struct('<H2xL8x')
+
+def whole_records(buf, size):
+    # View over the complete records in buf; a trailing partial record is ignored.
+    view = memoryview(buf).cast('B')
+    return view[:len(view) - len(view) % size]
+
+# Batch decoders: one pass over the buffer with a precompiled struct, giving the
+# same records as calling decode_*_data on every slice.
+def decode_users_28(buf):
+    return [{'uid': uid, 'role': role, 'name': name.decode('ascii').split('\0')[0], 'user_id': user_id}
+            for uid, role, name, user_id in USER_28.iter_unpack(whole_records(buf, 28))]
+
+def decode_users_72(buf):
+    view = whole_records(buf, 72)
+    return [{
+        'uid': uid,
+        'role': role,
+        'password': password.decode('ascii', errors='ignore').split('\0')[0],
+        'name': name.decode('ascii', errors='ignore').split('\0')[0],
+        'cardno': cardno,
+        'user_id': user_id.decode('ascii', errors='ignore').split('\0')[0]
+    } for (uid, role, password, name), (cardno, user_id) in zip(USER_72.iter_unpack(view), USER_72_TAIL.iter_unpack(view))]
+
+def decode_records_40(buf):
+    return [{'user_sn': user_sn, 'device_user_id': user_id.decode('ascii').split('\0')[0], 'record_time': parse_time_to_date(record_time)}
+            for user_sn, user_id, record_time in RECORD_40.iter_unpack(whole_records(buf, 40))]
+
+def decode_records_16(buf):
+    return [{'device_user_id': device_user_id, 'record_time': parse_time_to_date(record_time)}
+            for device_user_id, record_time in RECORD_16.iter_unpack(whole_records(buf, 16))]
+
+# CMD_GET_FREE_SIZES reply: a run of little-endian ints after the 8-byte
+# header, plus a face block on devices that support it.
+FREE_SIZES = {
+    'userCounts': 4,
+    'fingerCounts': 6,
+    'logCounts': 8,
+    'cardCounts': 12,
+    'fingerCapacity': 14,
+    'userCapacity': 15,
+    'logCapacity': 16,
+    'fingerAvailable': 17,
+    'userAvailable': 18,
+    'logAvailable': 19,
+}
+
+def decode_free_sizes(data):
+    payload = memoryview(data)[8:]
+    sizes = {name: struct.unpack_from('<I', payload, index * 4)[0]
+             for name, index in FREE_SIZES.items() if index * 4 + 4 <= len(payload)}
+    if len(payload) >= 92:
+        sizes['faceCounts'], _, sizes['faceCapacity'] = struct.unpack_from('<3I', payload, 80)
+    return sizes
+
+USER_28_OUT = struct.Struct('<HB5s8sIxBHI')
+USER_72_OUT = struct.Struct('<HB8s24sIx7sx24s')
+
+def encode_text(value):
+    return str(value).encode('ascii', errors='ignore')
+
+# Batch encoders: user dicts, keyed as the decoders return them, packed into one
+# buffer for a bulk write. group_id is optional.
+def encode_users_28(users):
+    buf = bytearray(USER_28_OUT.size * len(users))
+    for index, user in enumerate(users):
+        USER_28_OUT.pack_into(buf, index * USER_28_OUT.size, user['uid'], user.get('role', 0),
+                              encode_text(user.get('password', '')), encode_text(user.get('name', '')),
+                              user.get('cardno', 0), int(user.get('group_id', 0)), 0, int(user['user_id']))
+    return buf
+
+def encode_users_72(users):
+    buf = bytearray(USER_72_OUT.size * len(users))
+    for index, user in enumerate(users):
+        USER_72_OUT.pack_into(buf, index * USER_72_OUT.size, user['uid'], user.get('role', 0),
+                              encode_text(user.get('password', '')), encode_text(user.get('name', '')),
+                              user.get('cardno', 0), encode_text(user.get('group_id', '')), encode_text(user['user_id']))
+    return buf
+
 def decode_record_real_time_log_18(record_data):
     user_id = struct.unpack('<B', record_data[8:9])[0]
     att_time = parse_hex_to_time(record_data[12:18])
@@ -147,6 +235,13 @@ def decode_record_real_time_log_52(record_data):
     att_time = parse_hex_to_time(recv_data[26:32])
     return {'user_id': user_id, 'att_time': att_time}
 
+def real_time_log_delay(att_time, now=None):
+    # Seconds from the device's timestamp to now. The device clock is taken to be
+    # local time; parse_hex_to_time gives a zero-based month.
+    year, month, day, hour, minute, second = att_time
+    device_time = mktime((year, month + 1, day, hour, minute, second, 0, 0, -1))
+    return (now or current_time()) - device_time
+
 def decode_udp_header(header):
     command_id, checksum, session_id, reply_id = struct.unpack('<HHHH', header[:8])
     return {'command_id': command_id, 'checksum': checksum, 'session_id': session_id, 'reply_id': reply_id}